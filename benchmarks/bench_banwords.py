@@ -0,0 +1,122 @@
+"""
+Banword check: per-word regexes (the old check_banwords) against
+BanwordMatcher on a synthetic chat corpus. Also checks that both give the
+same verdict for every message.
+
+    python benchmarks/bench_banwords.py [--words N] [--messages N] [--banwords path]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.banword_matcher import BanwordMatcher, banword_pattern
+from modules.homoglyphs import CASE_VARIANTS, HOMOGLYPHS, normalize
+
+LETTERS = "абвгдежзийклмнопрстуфхцчшщъыьэюя"
+SEPARATORS = " .-_*!,"
+LOOKALIKES = {}
+for code, target in [*HOMOGLYPHS.items(), *CASE_VARIANTS.items()]:
+    LOOKALIKES.setdefault(target, []).append(chr(code))
+
+# (banword, message) pairs re.IGNORECASE matches although the letters differ
+CASE_CHECKS = [
+    ("сос", "ᲃоᲃ"),
+    ("вот", "ᲀᲂᲄ"),
+    ("тот", "ᲅоТ"),
+    ("дъ", "ᲁᲆ"),
+    ("σος", "ΣΟΣ"),
+    ("σοσ", "σος!"),
+    ("ſos", "SOS"),
+    ("bıg", "BIG"),
+]
+
+
+def random_word(rng, lo=2, hi=9):
+    return "".join(rng.choice(LETTERS) for _ in range(rng.randint(lo, hi)))
+
+def obfuscate(rng, word):
+    # what people do to get past the filter: repeats, separators, lookalikes
+    out = []
+    for ch in word:
+        if ch in LOOKALIKES and rng.random() < 0.3:
+            ch = rng.choice(LOOKALIKES[ch])
+        out.append(ch * rng.choice((1, 1, 1, 2, 3)))
+        if rng.random() < 0.2:
+            out.append(rng.choice(SEPARATORS) * rng.randint(1, 2))
+    return "".join(out)
+
+def make_corpus(rng, banwords, count):
+    messages = []
+    for _ in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(1, 40))]
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), obfuscate(rng, rng.choice(banwords)))
+        if rng.random() < 0.05:
+            # glued to other letters, must not match
+            words.append(random_word(rng) + rng.choice(banwords))
+        messages.append(" ".join(words))
+    return messages
+
+def bench(name, fn, messages, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        hits = sum(1 for text in messages if fn(text))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    per_msg = best / len(messages) * 1e6
+    print(f"{name:<10} {best * 1000:9.1f} ms  {per_msg:8.1f} us/msg  {hits} hits")
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--banwords", help="banwords.json to use instead of random words")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.banwords:
+        with open(args.banwords, "r", encoding="utf-8") as f:
+            banwords = sorted(json.load(f))
+    else:
+        banwords = sorted({random_word(rng, 3, 8) for _ in range(args.words)})
+
+    messages = make_corpus(rng, banwords, args.messages)
+    avg_len = sum(map(len, messages)) / len(messages)
+    print(f"{len(banwords)} banwords, {len(messages)} messages, {avg_len:.0f} chars avg")
+
+    patterns = [banword_pattern(normalize(word)) for word in banwords]
+    matcher = BanwordMatcher(banwords, normalize)
+
+    def regex_check(text):
+        norm = normalize(text)
+        return any(pat.search(norm) for pat in patterns)
+
+    def matcher_check(text):
+        return matcher.search(text) is not None
+
+    for word, text in CASE_CHECKS:
+        found = BanwordMatcher([word], normalize).search(text)
+        if not banword_pattern(normalize(word)).search(normalize(text)) or found != word:
+            print(f"{word!r} not found in {text!r}")
+            sys.exit(1)
+
+    mismatches = [text for text in messages if regex_check(text) != matcher_check(text)]
+    if mismatches:
+        print(f"{len(mismatches)} messages differ, first: {mismatches[0]!r}")
+        sys.exit(1)
+
+    regex_time = bench("regex", regex_check, messages)
+    matcher_time = bench("matcher", matcher_check, messages)
+    print(f"speedup    {regex_time / matcher_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+from .image_hash import BKTree, PHASH_MAX_DISTANCE, similar_images
+
+META_KEYS = ("mime_type", "duration", "width", "height", "file_size")
+
+
+class BanlistIndex:
+    """
+    Lookup tables over the media banlist: by sticker set, by file_unique_id
+    and by metadata. A rule matches metadata when all of its META_KEYS that
+    are set equal the media's, so rules are grouped by which keys they set
+    (a handful of shapes: video, photo, sticker...) and each group is a dict
+    keyed by those values. Rules with perceptual hashes of the image are
+    also kept in a BK-tree to find near-duplicates, and counted by
+    mime_type so media of a type no such rule has is never downloaded to
+    be hashed. Every rule remembers its
+    position in the banlist, so lookups return the same rule as scanning the
+    list in order would.
+    """
+
+    def __init__(self, rules=()):
+        self.rebuild(rules)
+
+    def rebuild(self, rules):
+        self.next_pos = 0
+        self.pos = {}
+        self.by_pack = {}
+        self.by_uid = {}
+        self.by_meta = {}
+        self.images = BKTree()
+        # mime_type -> number of rules with an image hash
+        self.image_kinds = {}
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self):
+        return len(self.pos)
+
+    def meta_key(rule: dict) -> tuple:
+        keys = tuple(k for k in META_KEYS if rule.get(k) is not None)
+        return keys, tuple(rule[k] for k in keys)
+
+    def buckets(self, rule: dict) -> list:
+        keys, values = BanlistIndex.meta_key(rule)
+        found = [self.by_meta.setdefault(keys, {}).setdefault(values, [])]
+        if rule.get("sticker_set_name"):
+            found.append(self.by_pack.setdefault(rule["sticker_set_name"], []))
+        if rule.get("file_unique_id"):
+            found.append(self.by_uid.setdefault(rule["file_unique_id"], []))
+        return found
+
+    def add(self, rule: dict):
+        self.pos[id(rule)] = self.next_pos
+        self.next_pos += 1
+        for bucket in self.buckets(rule):
+            bucket.append(rule)
+        if rule.get("image_hash"):
+            self.images.add(int(rule["image_hash"]["phash"], 16), rule)
+            kind = rule.get("mime_type")
+            self.image_kinds[kind] = self.image_kinds.get(kind, 0) + 1
+
+    def remove(self, rule: dict):
+        if self.pos.pop(id(rule), None) is None:
+            return
+
+        keys, values = BanlistIndex.meta_key(rule)
+        BanlistIndex.drop(self.by_meta[keys], values, rule)
+        if not self.by_meta[keys]:
+            del self.by_meta[keys]
+        if rule.get("sticker_set_name"):
+            BanlistIndex.drop(self.by_pack, rule["sticker_set_name"], rule)
+        if rule.get("file_unique_id"):
+            BanlistIndex.drop(self.by_uid, rule["file_unique_id"], rule)
+        if rule.get("image_hash"):
+            self.images.remove(int(rule["image_hash"]["phash"], 16), rule)
+            kind = rule.get("mime_type")
+            self.image_kinds[kind] -= 1
+            if not self.image_kinds[kind]:
+                del self.image_kinds[kind]
+
+    def drop(table: dict, key, rule: dict):
+        bucket = table.get(key, [])
+        for i, other in enumerate(bucket):
+            if other is rule:
+                del bucket[i]
+                break
+        if not bucket:
+            table.pop(key, None)
+
+    # buckets keep rules in the order they were added, so [0] is the earliest
+
+    def by_sticker_set(self, name):
+        bucket = self.by_pack.get(name)
+        return bucket[0] if bucket else None
+
+    def by_file(self, file_unique_id):
+        bucket = self.by_uid.get(file_unique_id)
+        return bucket[0] if bucket else None
+
+    def meta_matches(self, sig: dict) -> list:
+        found = []
+        for keys, table in self.by_meta.items():
+            bucket = table.get(tuple(sig.get(k) for k in keys))
+            if bucket:
+                found.extend(bucket)
+        return found
+
+    def by_meta_match(self, sig: dict):
+        return self.earliest(self.meta_matches(sig))
+
+    def has_image_rules(self, sig: dict) -> bool:
+        # photos and stickers have no mime_type and share the None bucket
+        return sig.get("mime_type") in self.image_kinds
+
+    def image_matches(self, hashes: dict) -> list:
+        if not hashes or not self.images:
+            return []
+        return [
+            rule
+            for rule in self.images.search(int(hashes["phash"], 16), PHASH_MAX_DISTANCE)
+            if similar_images(hashes, rule["image_hash"])
+        ]
+
+    def by_image(self, hashes: dict):
+        return self.earliest(self.image_matches(hashes))
+
+    def earliest(self, rules):
+        return min(rules, key=lambda rule: self.pos[id(rule)], default=None)
+
+    def first_match(self, sig: dict):
+        """
+        (reason, rule) for the earliest rule matching sig by sticker set,
+        file id, metadata or a similar image, reason being the first of
+        those it matches.
+        """
+        candidates = self.meta_matches(sig) + self.image_matches(sig.get("image_hash"))
+        if sig.get("sticker_set_name"):
+            candidates.extend(self.by_pack.get(sig["sticker_set_name"], ()))
+        if sig.get("file_unique_id"):
+            candidates.extend(self.by_uid.get(sig["file_unique_id"], ()))
+
+        rule = self.earliest(candidates)
+        if rule is None:
+            return None, None
+
+        if sig.get("sticker_set_name") and rule.get("sticker_set_name") == sig["sticker_set_name"]:
+            return "sticker_set_name", rule
+        if rule.get("file_unique_id") == sig.get("file_unique_id"):
+            return "file_unique_id", rule
+        if all(rule.get(k) is None or rule[k] == sig.get(k) for k in META_KEYS):
+            return "meta", rule
+        return "image", rule
+
+    def all_matches(self, sig: dict) -> list:
+        """Every rule matching sig in any way, in banlist order."""
+        found = {id(rule): rule for rule in self.meta_matches(sig)}
+        found.update((id(r), r) for r in self.image_matches(sig.get("image_hash")))
+        if sig.get("sticker_set_name"):
+            found.update((id(r), r) for r in self.by_pack.get(sig["sticker_set_name"], ()))
+        if sig.get("file_unique_id"):
+            found.update((id(r), r) for r in self.by_uid.get(sig["file_unique_id"], ()))
+        return sorted(found.values(), key=lambda rule: self.pos[id(rule)])
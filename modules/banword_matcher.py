@@ -0,0 +1,163 @@
+import re
+
+from collections import deque
+
+
+def banword_pattern(norm_word: str):
+    """
+    Regex for one normalized banword: each letter may be repeated and
+    followed by separators, and the word may not be glued to other letters.
+    """
+    return re.compile(
+        r'(?<![^\W\d_])' +  # not preceded by a letter
+        ''.join(
+            rf'(?:{re.escape(ch)}\W*)+'
+            for ch in norm_word
+        ) +
+        r'(?![^\W\d_])',     # not followed by a letter
+        re.IGNORECASE
+    )
+
+def is_word_char(ch: str) -> bool:
+    # \w
+    return ch.isalnum() or ch == "_"
+
+def is_letter(ch: str) -> bool:
+    # [^\W\d_]
+    return ch.isalnum() and not ch.isdecimal()
+
+def collapse_runs(text: str) -> list:
+    """'ааб' -> [['а', 2], ['б', 1]]"""
+    runs = []
+    for ch in text:
+        if runs and runs[-1][0] == ch:
+            runs[-1][1] += 1
+        else:
+            runs.append([ch, 1])
+    return runs
+
+
+class BanwordMatcher:
+    """
+    Finds any banword in one pass over the text, with the same result as
+    searching every banword_pattern() in turn. Letters are compared
+    exactly, which matches re.IGNORECASE only on text that `normalize`
+    already lowercased and folded (see homoglyphs.CASE_VARIANTS).
+
+    The patterns ignore separators (\\W) and let every letter repeat, so the
+    text is reduced to runs of word characters with separators dropped,
+    e.g. 'х-х у.й' -> [х×2, у×1, й×1], remembering where each character was.
+    An Aho-Corasick automaton over the run letters of all banwords finds the
+    candidates. Each one is then checked for run lengths (a doubled letter in
+    a banword needs at least two in the text) and for letters right before
+    and after the match in the original text. Banwords that contain
+    separators themselves are rare and are still searched with their regex.
+    """
+
+    def __init__(self, words, normalize):
+        self.normalize = normalize
+        self.fallback = []
+        self.words = []
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for word in words:
+            norm = normalize(word)
+            if not norm or not all(is_word_char(ch) for ch in norm):
+                self.fallback.append((word, banword_pattern(norm)))
+                continue
+
+            runs = collapse_runs(norm)
+            node = 0
+            for ch, _ in runs:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(len(self.words))
+            self.words.append((word, [count for _, count in runs]))
+
+        self.build_fail_links()
+
+    def __len__(self):
+        return len(self.words) + len(self.fallback)
+
+    def build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def search(self, text: str):
+        """Returns the first banword found in text, or None."""
+        return self.search_normalized(self.normalize(text))
+
+    def search_normalized(self, norm: str):
+        for word, pattern in self.fallback:
+            if pattern.search(norm):
+                return word
+
+        if not self.words:
+            return None
+
+        # runs of word characters, separators between copies don't break a run
+        run_chars = []
+        run_pos = []
+        for i, ch in enumerate(norm):
+            if not is_word_char(ch):
+                continue
+            if run_chars and run_chars[-1] == ch:
+                run_pos[-1].append(i)
+            else:
+                run_chars.append(ch)
+                run_pos.append([i])
+
+        node = 0
+        for j, ch in enumerate(run_chars):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+
+            for idx in self.out[node]:
+                word, counts = self.words[idx]
+                if self.verify(norm, run_pos, j - len(counts) + 1, j, counts):
+                    return word
+
+        return None
+
+    def verify(self, norm: str, run_pos: list, first: int, last: int, counts: list) -> bool:
+        # runs in between are taken whole, they only need to be long enough
+        for k in range(1, len(counts) - 1):
+            if len(run_pos[first + k]) < counts[k]:
+                return False
+
+        def free_before(i):
+            return i == 0 or not is_letter(norm[i - 1])
+
+        def free_after(i):
+            return i + 1 == len(norm) or not is_letter(norm[i + 1])
+
+        # the match may start at any copy of the first letter that has no
+        # letter right before it, the earliest such copy leaves the most room
+        start_run = run_pos[first]
+        start = next((t for t, i in enumerate(start_run) if free_before(i)), None)
+        if start is None:
+            return False
+
+        if first == last:
+            return any(free_after(i) for i in start_run[start + counts[0] - 1:])
+
+        if len(start_run) - start < counts[0]:
+            return False
+        return any(free_after(i) for i in run_pos[last][counts[-1] - 1:])
@@ -1,4 +1,6 @@
+import asyncio
 import glob
+import hashlib
 import json
 import logging
 import os
@@ -10,13 +12,26 @@ from dotenv import load_dotenv
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
 from pathlib import Path
 
 from telethon import TelegramClient
 
+from .banlist_index import BanlistIndex
+from .banword_matcher import BanwordMatcher
+from .cache import TTLCache
+from .emoji_table import build_emoji_table, table_weight
+from .forward_map import ForwardMap
+from .homoglyphs import HOMOGLYPHS, normalize
+from .leaderboard import Leaderboard
+from .rating_journal import RatingJournal, apply_rating_event
+from .rating_totals import RatingTotals
+from .rate_limiter import BACKGROUND, INTERACTIVE, MODERATION
+from .reaction_limiter import ReactionLimiter
+from .state_store import StateStore
+
 # ─── CONFIG ─────────────────────────────────────────────────────────────────────
 load_dotenv()
 
@@ -39,6 +54,11 @@ WEB_APP_NAME      = os.environ["WEB_APP_NAME"]
 CASINO_JOIN_LINK  = os.environ["CASINO_JOIN_LINK"]
 
 COCKBOT_USERNAME  = os.environ["COCKBOT_USERNAME"]
+
+STATE_FLUSH_INTERVAL  = float(os.environ.get("STATE_FLUSH_INTERVAL", 30))
+STATE_FLUSH_THRESHOLD = int(os.environ.get("STATE_FLUSH_THRESHOLD", 500))
+RATING_COMPACT_INTERVAL = float(os.environ.get("RATING_COMPACT_INTERVAL", 600))
+RATING_JOURNAL_RETENTION_DAYS = float(os.environ.get("RATING_JOURNAL_RETENTION_DAYS", 62))
 # ────────────────────────────────────────────────────────────────────────────────
 
 scope = ["https://www.googleapis.com/auth/spreadsheets"]
@@ -65,6 +85,7 @@ SOCIAL_RATING_FILE = BASE_DIR / "social_rating.json"
 WEIGHTS_FILE = BASE_DIR / "emoji_weights.json"
 BANWORDS_FILE = BASE_DIR / "banwords.json"
 META_FILE = BASE_DIR / "meta.json"
+STATE_DB_FILE = BASE_DIR / "state.db"
 SOCIAL_ADD_RATING_IMAGE = BASE_DIR / "add_rating.png"
 SOCIAL_SUB_RATING_IMAGE = BASE_DIR / "sub_rating.png"
 CASINO_IMAGE = BASE_DIR / "casino.jpg"
@@ -74,10 +95,58 @@ TYUMEN = ZoneInfo("Asia/Yekaterinburg")
 EDIT_TIMEOUT = timedelta(hours=48)
 CHAT_AFK_TIMEOUT = timedelta(minutes=30)
 PAGE_SIZE = 10
+LEADERBOARD_MODES = ("global", "daily", "cock", "social", "social_global", "casino")
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL = timedelta(hours=6)
+PROFILE_MISS_TTL = timedelta(minutes=30)
+PROFILE_FETCH_CONCURRENCY = 5
+CHAT_META_CACHE_SIZE = 100
+MESSAGE_META_CACHE_SIZE = 20000
+# reactions that come this close together share one get_messages call
+MESSAGE_META_BATCH_DELAY = 0.05
+MESSAGE_META_BATCH_SIZE = 100
+MEDIA_HASH_CACHE_SIZE = 5000
+HASH_CHUNK_SIZE = 1 << 20
+VERDICT_CACHE_SIZE = 10000
+CHAT_META_TTL = timedelta(hours=1)
+STATS_PAGE_CACHE_SIZE = 500
+# Telegram allows a bot about 30 messages per second, one per second in a
+# private chat and 20 per minute in a group
+API_GLOBAL_RATE = 30
+API_PRIVATE_CHAT_RATE = 1
+API_GROUP_CHAT_RATE = 20 / 60
+API_GROUP_CHAT_BURST = 20
+API_MAX_RETRIES = 3
+FANOUT_WORKERS = 16
+# counted reactions per reactor: (count, seconds, min_history), a reaction
+# is not counted if the count-th newest one is less than seconds old and the
+# reactor has at least min_history reactions on record
+REACTION_RATE_LIMITS = [
+    (3, 30, 3),
+    (5, 5 * 60, 10),
+    (10, 30 * 60, 30),
+]
+REACTION_HISTORY_SIZE = 60
+# updates of one user's reactions to a message within this many seconds are
+# counted as one change
+REACTION_COALESCE_DELAY = 2.0
+REACTION_BATCH_SIZE = 200
+# updates handled at once, ones of the same user or message still go in order
+UPDATE_CONCURRENCY = 64
+# edits of one message that come within this many seconds are sent once
+EDIT_COALESCE_DELAY = 1.0
+FORWARD_EVICT_INTERVAL = 3600
+# chat member statuses of users who are not in the chat
+LEFT_STATUSES = ("left", "kicked")
+# names on a cached page may go stale, the board version covers the scores
+STATS_PAGE_CACHE_TTL = timedelta(minutes=1)
 
 db = sqlite3.connect("info.db", check_same_thread=False)
 db.row_factory = sqlite3.Row
 
+store = StateStore(STATE_DB_FILE)
+journal = RatingJournal(store, RATING_JOURNAL_RETENTION_DAYS * 86400)
+
 TARGET_NICKS = [
     "Рыжая голова",
     "Рыжопеч",
@@ -89,46 +158,25 @@ TARGET_NICKS = [
     "Рыжая рептилия"
 ]
 
-HOMOGLYPHS = {
-    ord('x'): 'х', ord('X'): 'х',
-    ord('o'): 'о', ord('O'): 'о', ord('0'): 'о', ord('օ'): 'о',
-    ord('a'): 'а', ord('A'): 'а', ord('@'): 'а',
-    ord('p'): 'р', ord('P'): 'р',
-    ord('h'): 'н', ord('H'): 'н',
-    ord('t'): 'т', ord('T'): 'т',
-    ord('y'): 'у', ord('Y'): 'у',
-    ord('k'): 'к', ord('K'): 'к',
-    ord('c'): 'с', ord('C'): 'с',
-    ord('m'): 'м', ord('M'): 'м',
-    ord('e'): 'е', ord('E'): 'е',
-    ord('b'): 'в', ord('B'): 'в',
-    ord('n'): 'п', ord('N'): 'п', ord('u'): 'п', ord('U'): 'п',
-    ord('r'): 'г', ord('R'): 'г',
-    ord('3'): 'з',
-    ord('6'): 'б',
-    ord('9'): 'д',
-    ord('x'): 'х',
-    ord('X'): 'х',
-    ord('×'): 'х',
-    ord('✕'): 'х',
-    ord('❌'): 'х',
-    ord('⤫'): 'х',
-    ord('ҳ'): 'х',
-    ord('🞩'): 'х',
-    ord('χ'): 'х',
-    ord('𝔁'): 'х',
-    ord('𝕏'): 'х',
-    ord('ⅹ'): 'х',
-    ord('Ⅹ'): 'х',
-    ord('ꭓ'): 'х',
-    ord('ⲭ'): 'х',
-}
-
 def daily_path_for_(date_obj: datetime.date) -> Path:
     return DAILY_STATS_DIR / f"daily_stats_{date_obj.isoformat()}.json"
 
-def normalize(text):
-    return text.translate(HOMOGLYPHS).lower()
+def normalize_ban_rule(entry: dict) -> dict:
+    item = dict(entry)
+
+    if "ban_type" not in item:
+        soft = item.pop("soft", None)
+
+        if soft is None or not soft:
+            item["ban_type"] = "ban"
+        else:
+            item["ban_type"] = "block"
+
+    return item
+
+def ban_rule_key(rule: dict) -> str:
+    raw = json.dumps(rule, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -143,7 +191,8 @@ class BotState:
         cls.MODERATORS = cls.load_moderators()
         print("Moderators: ", cls.MODERATORS)
         cls.META_INFO = {}
-        cls.forward_map = {}
+        cls.forward_map = ForwardMap()
+        cls.cold_forward_keys = set()
         cls.banlist = []
         cls.message_stats = {}
         cls.daily_stats = {}
@@ -151,20 +200,42 @@ class BotState:
         cls.last_sizes = {}
         cls.social_rating = {}
         cls.old_social_rating = {}
+        cls.rating_totals = RatingTotals()
+        cls.old_rating_totals = RatingTotals()
+        cls.leaderboards = {mode: Leaderboard() for mode in LEADERBOARD_MODES}
+        cls.casino_data_version = None
+        cls.profiles = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL.total_seconds())
+        cls.stats_pages = TTLCache(STATS_PAGE_CACHE_SIZE, STATS_PAGE_CACHE_TTL.total_seconds())
+        cls.shown_stats_pages = TTLCache(STATS_PAGE_CACHE_SIZE)
+        cls.chat_meta = TTLCache(CHAT_META_CACHE_SIZE, CHAT_META_TTL.total_seconds())
+        cls.message_meta = TTLCache(MESSAGE_META_CACHE_SIZE)
+        cls.media_hashes = TTLCache(MEDIA_HASH_CACHE_SIZE)
+        cls.image_hashes = TTLCache(MEDIA_HASH_CACHE_SIZE)
+        cls.media_verdicts = TTLCache(VERDICT_CACHE_SIZE)
         cls.emoji_weights = {}
+        cls.emoji_table = {}
         cls.slot = True
         cls.indexed_users = {}
         cls.rd_users = set()
+        cls.chat_members = {}
+        cls.reaction_limiter = ReactionLimiter(REACTION_RATE_LIMITS, REACTION_HISTORY_SIZE)
         cls.mc = None
+        cls.dirty = {}
+        cls.dirty_count = 0
+        cls.flush_needed = asyncio.Event()
         
+        cls.migrate_json_state()
         cls.load_forward_map()
+        cls.load_chat_members()
         cls.load_banlist()
         cls.load_stats()
         cls.load_last_sizes()
         cls.load_old_social_rating()
+        cls.load_reaction_limits()
         cls.load_social_rating()
         cls.load_emoji_weights()
         cls.load_meta_info()
+        cls.rebuild_leaderboards()
         cls.compile_patterns()
         cls.ensure_helpers_table()
         cls.ensure_slot_rolls_table()
@@ -176,28 +247,43 @@ class BotState:
 
     @classmethod
     def compile_patterns(cls):
-        cls.patterns_ = [
-            re.compile(
-                r'(?<![^\W\d_])' +  # not preceded by a letter
-                ''.join(
-                    rf'(?:{re.escape(ch)}\W*)+'
-                    for ch in normalize(word)
-                ) +
-                r'(?![^\W\d_])',     # not followed by a letter
-                re.IGNORECASE
-            )
-            for word in cls.BANWORDS
-        ]
-        print("len: ", len(cls.patterns_))
-        #print("_patterns: ", _patterns)
+        cls.banword_matcher = BanwordMatcher(cls.BANWORDS, normalize)
+        # verdicts of the old banwords are no good anymore
+        cls.text_verdicts = TTLCache(VERDICT_CACHE_SIZE)
+        print("len: ", len(cls.banword_matcher))
+
+    @classmethod
+    def reset_media_verdicts(cls):
+        # a new object rather than clear(), so checks that were already
+        # running store their verdict in the old one
+        cls.media_verdicts = TTLCache(VERDICT_CACHE_SIZE)
+
+    @classmethod
+    def migrate_json_state(cls):
+        store.migrate_json("social_rating", SOCIAL_RATING_FILE)
+        store.migrate_json("message_stats", STATS_FILE)
+        store.migrate_json("forward_map", FORWARD_MAP_FILE)
+        store.migrate_json("last_sizes", LAST_SIZES_FILE)
+        store.migrate_json(
+            "meta", META_FILE,
+            lambda data: {k: v for k, v in data.items() if k != "user_message_counts"}
+        )
+        store.migrate_json(
+            "meta_user_counts", META_FILE,
+            lambda data: data.get("user_message_counts", {})
+        )
+        store.migrate_json(
+            "banlist", BANLIST_FILE,
+            lambda data: {
+                ban_rule_key(rule): rule
+                for rule in map(normalize_ban_rule, filter(lambda e: isinstance(e, dict), data))
+            }
+        )
 
     @classmethod
     def load_meta_info(cls):
-        try:
-            with open(META_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = {}
+        data = store.load("meta")
+        data["user_message_counts"] = store.load("meta_user_counts")
 
         cls.META_INFO["afk_time"] = data.get("afk_time", 0)
         cls.META_INFO["alive_time"] = data.get("alive_time", 0)
@@ -241,6 +327,13 @@ class BotState:
             except Exception:
                 # keep defaults on error
                 pass
+        cls.emoji_table = build_emoji_table(cls.emoji_weights)
+
+    @classmethod
+    def set_emoji_weight(cls, key: str, weight: int):
+        cls.emoji_weights[key] = weight
+        cls.emoji_table = build_emoji_table(cls.emoji_weights)
+        cls.save_emoji_weights()
 
     @classmethod
     def save_emoji_weights(cls):
@@ -296,11 +389,14 @@ class BotState:
                     rc_hist["count"] += count
                     rc_hist["value"] += value
 
+        cls.old_rating_totals.rebuild(cls.old_social_rating)
+
     @classmethod
     def load_social_rating(cls):
         try:
-            raw = json.loads(open(SOCIAL_RATING_FILE, encoding="utf-8").read())
+            raw = store.load("social_rating")
             cls.social_rating = {}
+            legacy_dates = {}
 
             for uid_str, v in raw.items():
                 uid = int(uid_str)
@@ -323,49 +419,187 @@ class BotState:
                 cls.social_rating[uid] = {
                     "reactor_counts": rc_new,
                     "banned":          bool(v.get("banned", False)),
+                    "total_reacts":    int(v.get("total_reacts", 0)),
                     "additional_chat": int(v.get("additional_chat", 0)),
                     "additional_neri": int(v.get("additional_neri", 0)),
                     "additional_self": int(v.get("additional_self", 0)),
                     "boosts":          int(v.get("boosts", 0)),
                     "manual_rating":   int(v.get("manual_rating", 0)),
-                    "reactor_dates":   v.get("reactor_dates", []),
                 }
 
-        except (FileNotFoundError, json.JSONDecodeError):
+                if v.get("reactor_dates"):
+                    legacy_dates[uid] = v["reactor_dates"]
+
+            if legacy_dates:
+                cls.migrate_reactor_dates(legacy_dates)
+
+        except (ValueError, TypeError, json.JSONDecodeError):
             cls.social_rating = {}
 
+        tail = journal.tail(journal.snapshot_seq())
+        for kind, author_id, reactor_id, delta in tail:
+            apply_rating_event(cls.social_rating, kind, author_id, reactor_id, delta)
+        if tail:
+            print(f"Replayed {len(tail)} social rating events after the snapshot")
+            journal.replace_all = True
+
+        cls.rating_totals.rebuild(cls.social_rating)
+
     @classmethod
-    def save_social_rating(cls):
-        dump = {
-            str(uid): {
-                "reactor_counts": {
-                    str(rid): {
-                        "count":         info_rc["count"],
-                        "value":         info_rc["value"],
-                    }
-                    for rid, info_rc in info["reactor_counts"].items()
-                },
-                "banned":           info.get("banned", False),
-                "total_reacts":     info.get("total_reacts", 0),
-                "additional_chat":  info.get("additional_chat", 0),
-                "additional_neri":  info.get("additional_neri", 0),
-                "additional_self":  info.get("additional_self", 0),
-                "boosts":           info.get("boosts", 0),
-                "manual_rating":    info.get("manual_rating", 0),
-                "reactor_dates":    info.get("reactor_dates", []),
+    def record_rating_event(cls, kind: str, author_id=None, reactor_id=None, delta: int = 0):
+        apply_rating_event(cls.social_rating, kind, author_id, reactor_id, delta)
+        journal.append(kind, author_id, reactor_id, delta)
+        changed = cls.rating_totals.on_event(cls.social_rating, kind, author_id, reactor_id, delta)
+        cls.refresh_leaderboard("social", *changed)
+        cls.refresh_leaderboard("social_global", *changed)
+
+        if kind == "reset":
+            journal.replace_all = True
+            journal.dirty.clear()
+        else:
+            journal.dirty.add(author_id)
+
+        if len(journal.pending) >= STATE_FLUSH_THRESHOLD:
+            cls.flush_needed.set()
+
+    @classmethod
+    def leaderboard_score(cls, mode: str, uid):
+        # (score, extra) of uid in a /top mode, or None if it is not listed there
+        if mode == "global":
+            if uid in cls.message_stats:
+                return cls.message_stats[uid], None
+        elif mode == "daily":
+            if uid in cls.daily_stats:
+                return cls.daily_stats[uid], None
+        elif mode == "cock":
+            if uid in cls.last_sizes:
+                return cls.last_sizes[uid]["size"], None
+        elif mode == "social":
+            if uid != TARGET_USER and uid in cls.social_rating:
+                return cls.rating_totals.total(uid), cls.rating_totals.neri(uid)
+        elif mode == "social_global":
+            if uid != TARGET_USER and uid in cls.old_social_rating:
+                return (
+                    cls.old_rating_totals.total(uid) + cls.rating_totals.total(uid),
+                    cls.old_rating_totals.neri(uid) + cls.rating_totals.neri(uid),
+                )
+        return None
+
+    @classmethod
+    def rebuild_leaderboards(cls, *modes):
+        sources = {
+            "global":        cls.message_stats,
+            "daily":         cls.daily_stats,
+            "cock":          cls.last_sizes,
+            "social":        cls.social_rating,
+            "social_global": cls.old_social_rating,
+        }
+        for mode in modes or LEADERBOARD_MODES:
+            if mode == "casino":
+                # rebuilt from the database on the next read
+                cls.casino_data_version = None
+                continue
+
+            items = []
+            for uid in sources[mode]:
+                score = cls.leaderboard_score(mode, uid)
+                if score is not None:
+                    items.append((uid, *score))
+            cls.leaderboards[mode].rebuild(items)
+
+    @classmethod
+    def refresh_leaderboard(cls, mode: str, *uids):
+        board = cls.leaderboards[mode]
+        for uid in uids:
+            score = cls.leaderboard_score(mode, uid)
+            if score is None:
+                board.remove(uid)
+            else:
+                board.set(uid, *score)
+
+    @classmethod
+    def leaderboard(cls, mode: str):
+        board = cls.leaderboards.get(mode)
+        if mode == "casino":
+            # coins are also changed by server.py and API_handler.py, which
+            # bump the data_version seen by this connection
+            version = db.execute("PRAGMA data_version").fetchone()[0]
+            if version != cls.casino_data_version:
+                rows = db.execute("SELECT id, coins FROM user").fetchall()
+                board.rebuild((r["id"], r["coins"] or 0, None) for r in rows)
+                cls.casino_data_version = version
+        return board
+
+    @classmethod
+    def load_reaction_limits(cls):
+        cls.reaction_limiter.clear()
+        for key, stamps in store.load("reaction_limits").items():
+            try:
+                cls.reaction_limiter.load(int(key), [float(ts) for ts in stamps])
+            except (ValueError, TypeError):
+                continue
+
+    @classmethod
+    def migrate_reactor_dates(cls, legacy_dates: dict):
+        # reactor_dates used to be ISO strings (utcnow) in the rating entries
+        migrated = [uid for uid in legacy_dates if uid not in cls.reaction_limiter.times]
+        for uid in migrated:
+            stamps = []
+            for ts in legacy_dates[uid]:
+                try:
+                    stamps.append(datetime.fromisoformat(ts).replace(tzinfo=timezone.utc).timestamp())
+                except (ValueError, TypeError):
+                    continue
+            cls.reaction_limiter.load(uid, stamps)
+        if migrated:
+            cls.mark_dirty("reaction_limits", *migrated)
+        # the next snapshot is written without them
+        journal.replace_all = True
+        print(f"Moved reactor_dates of {len(migrated)} users out of the social rating")
+
+    @classmethod
+    def take_rating_snapshot(cls):
+        if journal.replace_all:
+            upserts = {
+                uid: BotState.dump_social_rating_entry(info)
+                for uid, info in cls.social_rating.items()
+            }
+            deletes = None
+        else:
+            upserts = {
+                uid: BotState.dump_social_rating_entry(cls.social_rating[uid])
+                for uid in journal.dirty if uid in cls.social_rating
             }
-            for uid, info in cls.social_rating.items()
+            deletes = [uid for uid in journal.dirty if uid not in cls.social_rating]
+
+        journal.dirty = set()
+        journal.replace_all = False
+        return upserts, deletes, journal.last_seq
+
+    def dump_social_rating_entry(info: dict) -> dict:
+        return {
+            "reactor_counts": {
+                str(rid): {
+                    "count":         info_rc["count"],
+                    "value":         info_rc["value"],
+                }
+                for rid, info_rc in info.get("reactor_counts", {}).items()
+            },
+            "banned":           info.get("banned", False),
+            "total_reacts":     info.get("total_reacts", 0),
+            "additional_chat":  info.get("additional_chat", 0),
+            "additional_neri":  info.get("additional_neri", 0),
+            "additional_self":  info.get("additional_self", 0),
+            "boosts":           info.get("boosts", 0),
+            "manual_rating":    info.get("manual_rating", 0),
         }
-        with open(SOCIAL_RATING_FILE, "w", encoding="utf-8") as f:
-            json.dump(dump, f, ensure_ascii=False, indent=2)
 
     @classmethod
     def load_stats(cls):
         try:
-            with open(STATS_FILE, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-                cls.message_stats = {int(k): int(v) for k, v in raw.items()}
-        except (FileNotFoundError, json.JSONDecodeError):
+            raw = store.load("message_stats")
+            cls.message_stats = {int(k): int(v) for k, v in raw.items()}
+        except (ValueError, TypeError):
             cls.message_stats = {}
 
         today = datetime.now(TYUMEN).date()
@@ -380,11 +614,6 @@ class BotState:
         else:
             cls.daily_stats = {}
 
-    @classmethod
-    def save_stats(cls):
-        with open(STATS_FILE, "w", encoding="utf-8") as f:
-            json.dump(cls.message_stats, f, ensure_ascii=False, indent=2)
-
     @classmethod
     def save_daily_stats(cls):
         today = datetime.now(TYUMEN).date()
@@ -396,117 +625,222 @@ class BotState:
     @classmethod
     def load_last_sizes(cls):
         try:
-            with open(LAST_SIZES_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                cls.last_sizes = {
-                    int(uid): {"size": float(v["size"]), "ts": v["ts"]}
-                    for uid, v in data.items()
-                }
-        except (FileNotFoundError, json.JSONDecodeError):
+            data = store.load("last_sizes")
+            cls.last_sizes = {
+                int(uid): {"size": float(v["size"]), "ts": v["ts"]}
+                for uid, v in data.items()
+            }
+        except (ValueError, TypeError, KeyError):
             cls.last_sizes = {}
 
     @classmethod
-    def save_last_sizes(cls):
-        to_dump = {
-            str(uid): {"size": info["size"], "ts": info["ts"]}
-            for uid, info in cls.last_sizes.items()
+    def load_banlist(cls):
+        cls.banlist = [
+            normalize_ban_rule(entry)
+            for entry in store.load("banlist").values()
+            if isinstance(entry, dict)
+        ]
+        cls.banlist_index = BanlistIndex(cls.banlist)
+
+    def dump_forward_entry(entry: dict) -> dict:
+        return {
+            "text": entry.get("text", ""),
+            "has_media": entry.get("has_media", False),
+            "forwards": list(entry.get("forwards", [])),
+            "failed": list(entry.get("failed", [])),
+            "timestamp": entry.get("timestamp", "")
         }
-        with open(LAST_SIZES_FILE, "w", encoding="utf-8") as f:
-            json.dump(to_dump, f, ensure_ascii=False, indent=2)
 
-    @classmethod
-    def load_banlist(cls):
-        with open(BANLIST_FILE, "r", encoding="utf-8") as f:
-            cls.banlist = json.load(f)
-        
-        try:
-            with open(BANLIST_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            cls.banlist = []
-            return
+    def parse_forward_entry(value):
+        if isinstance(value, list):
+            return {
+                "text": "Это сообщение слишком старое..",
+                "has_media": False,
+                "timestamp": "",
+                "forwards": [
+                    (int(c), int(m), False) for c, m in value
+                ],
+                "failed": [],
+            }
 
-        if not isinstance(data, list):
-            raise ValueError("BANLIST_FILE must contain a JSON array of objects.")
+        if isinstance(value, dict):
+            return {
+                "text": value.get("text", ""),
+                "has_media": value.get("has_media", False),
+                "timestamp": value.get("timestamp", ""),
+                "forwards": [
+                    (int(c), int(m), bool(k)) for c, m, k in value.get("forwards", [])
+                ],
+                "failed": [
+                    (int(c), str(reason)) for c, reason in value.get("failed", [])
+                ]
+            }
 
-        normalized = []
+        return None
 
-        for entry in data:
-            if not isinstance(entry, dict):
-                continue
+    @classmethod
+    def load_forward_map(cls):
+        cls.forward_map.clear()
 
-            item = dict(entry)
+        data = store.load("forward_map")
 
-            if "ban_type" not in item:
-                soft = item.pop("soft", None)
+        for key, value in data.items():
+            try:
+                orig_str, msg_str = key.split(":", 1)
+                orig_id = int(orig_str)
+                msg_id = int(msg_str)
+            except ValueError:
+                continue
 
-                if soft is None or not soft:
-                    item["ban_type"] = "ban"
-                else:
-                    item["ban_type"] = "block"
+            entry = BotState.parse_forward_entry(value)
+            if entry is not None:
+                cls.forward_map.add((orig_id, msg_id), entry)
 
-            normalized.append(item)
+        rows = cls.expire_forwards()
+        if rows:
+            BotState.move_cold_forwards(rows)
+            print(f"Moved {len(rows)} old forwards to cold storage")
 
-        cls.banlist = normalized
+        # state keys of the cold collection, so edits and deletes of messages
+        # that were never forwarded don't have to ask the database
+        cls.cold_forward_keys = store.keys("forward_map_cold")
 
     @classmethod
-    def save_banlist(cls):
-        with open(BANLIST_FILE, "w", encoding="utf-8") as f:
-            json.dump(cls.banlist, f, ensure_ascii=False, indent=2)
+    def expire_forwards(cls) -> dict:
+        """
+        Drops forwards older than EDIT_TIMEOUT from memory and returns their
+        rows for the cold collection.
+        """
+        cutoff = (datetime.utcnow() - EDIT_TIMEOUT).isoformat()
+        expired = cls.forward_map.expire(cutoff)
+        return {
+            BotState.state_key(key): BotState.dump_forward_entry(entry)
+            for key, entry in expired.items()
+        }
+
+    def move_cold_forwards(rows: dict):
+        store.ensure_collection("forward_map_cold")
+        with store.lock, store.conn:
+            store.upsert_rows("forward_map_cold", rows)
+            store.delete_rows("forward_map", rows)
 
     @classmethod
-    def save_forward_map(cls):
-        serializable = {}
-        for (orig_id, msg_id), entry in cls.forward_map.items():
-            key = f"{orig_id}:{msg_id}"
+    def is_forwarded(cls, key) -> bool:
+        return key in cls.forward_map or BotState.state_key(key) in cls.cold_forward_keys
 
-            serializable[key] = {
-                "text": entry.get("text", ""),
-                "has_media": entry.get("has_media", False),
-                "forwards": entry.get("forwards", []),
-                "timestamp": entry.get("timestamp", "")
-            }
+    def cold_forward_entry(key):
+        # blocking, run it in a thread
+        value = store.get("forward_map_cold", BotState.state_key(key))
+        return BotState.parse_forward_entry(value)
 
-        with open(FORWARD_MAP_FILE, "w", encoding="utf-8") as f:
-            json.dump(serializable, f, ensure_ascii=False, indent=2)
+    def drop_cold_forward(key):
+        store.write("forward_map_cold", {}, [BotState.state_key(key)])
 
     @classmethod
-    def load_forward_map(cls):
-        cls.forward_map.clear()
-
-        try:
-            with open(FORWARD_MAP_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return
-
-        for key, value in data.items():
+    def load_chat_members(cls):
+        cls.chat_members.clear()
+        for key, value in store.load("chat_members").items():
             try:
-                orig_str, msg_str = key.split(":", 1)
-                orig_id = int(orig_str)
-                msg_id = int(msg_str)
+                uid = int(key)
             except ValueError:
                 continue
+            cls.chat_members[uid] = {
+                "status": value.get("status", "member"),
+                "joined": value.get("joined"),
+            }
 
-            if isinstance(value, list):
-                cls.forward_map[(orig_id, msg_id)] = {
-                    "text": "Это сообщение слишком старое..",
-                    "has_media": False,
-                    "timestamp": "",
-                    "forwards": [
-                        (int(c), int(m), False) for c, m in value
-                    ]
-                }
+    @classmethod
+    def meta_rows(cls) -> dict:
+        first_dt = cls.META_INFO.get("first_message_time", datetime.now())
+        last_dt  = cls.META_INFO.get("last_message_time",  datetime.now())
+        join_dt  = cls.META_INFO.get("join_bot_time",  datetime.now())
 
-            elif isinstance(value, dict):
-                cls.forward_map[(orig_id, msg_id)] = {
-                    "text": value.get("text", ""),
-                    "has_media": value.get("has_media", False),
-                    "timestamp": value.get("timestamp", ""),
-                    "forwards": [
-                        (int(c), int(m), bool(k)) for c, m, k in value.get("forwards", [])
-                    ]
-                }
+        return {
+            "afk_time": cls.META_INFO.get("afk_time", 0),
+            "alive_time": cls.META_INFO.get("alive_time", 0),
+            "messages_in_current_streak": cls.META_INFO.get("messages_in_current_streak", 0),
+            "top_streak_messages": cls.META_INFO.get("top_streak_messages", 0),
+            "first_message_time": first_dt.timestamp(),
+            "last_message_time":  last_dt.timestamp(),
+            "join_bot_time":  join_dt.timestamp(),
+        }
+
+    @classmethod
+    def state_collection(cls, name: str) -> tuple:
+        """
+        (in-memory source, row serializer) of a collection. Only the one
+        asked for is built, hashing the banlist or collecting the meta rows
+        is not free.
+        """
+        builders = {
+            "message_stats":    lambda: (cls.message_stats, int),
+            "last_sizes":       lambda: (cls.last_sizes, lambda info: {"size": info["size"], "ts": info["ts"]}),
+            "forward_map":      lambda: (cls.forward_map, BotState.dump_forward_entry),
+            "meta":             lambda: (cls.meta_rows(), lambda v: v),
+            "meta_user_counts": lambda: (cls.META_INFO.get("user_message_counts", {}), int),
+            "banlist":          lambda: ({ban_rule_key(rule): rule for rule in cls.banlist}, dict),
+            "chat_members":     lambda: (cls.chat_members, dict),
+            "reaction_limits":  lambda: (cls.reaction_limiter.times, list),
+        }
+        return builders[name]()
+
+    def state_key(key) -> str:
+        if isinstance(key, tuple):
+            return ":".join(map(str, key))
+        return str(key)
+
+    @classmethod
+    def state_rows(cls, name: str, keys=None):
+        """
+        Serializes the rows of a collection. With keys=None every row is
+        returned and deletes is None, meaning the table is replaced whole.
+        """
+        source, dump = cls.state_collection(name)
+        if keys is None:
+            return {BotState.state_key(k): dump(v) for k, v in source.items()}, None
+
+        upserts = {BotState.state_key(k): dump(source[k]) for k in keys if k in source}
+        deletes = [BotState.state_key(k) for k in keys if k not in source]
+        return upserts, deletes
+
+    def write_state_rows(batches, events=()):
+        for name, upserts, deletes in batches:
+            if deletes is None:
+                store.replace(name, upserts)
+            else:
+                store.write(name, upserts, deletes)
+        if events:
+            journal.write_events(events)
+
+    @classmethod
+    def mark_dirty(cls, name: str, *keys):
+        """
+        Schedules rows of a collection for the next flush. Without keys the
+        whole collection is rewritten.
+        """
+        if not keys:
+            cls.dirty[name] = None
+        elif name not in cls.dirty:
+            cls.dirty[name] = set(keys)
+        elif cls.dirty[name] is not None:
+            cls.dirty[name].update(keys)
+
+        cls.dirty_count += max(len(keys), 1)
+        if cls.dirty_count >= STATE_FLUSH_THRESHOLD:
+            cls.flush_needed.set()
+
+    @classmethod
+    def take_dirty_rows(cls) -> list:
+        # runs on the event loop, so the snapshot is consistent with memory
+        batches = []
+        for name, keys in cls.dirty.items():
+            upserts, deletes = cls.state_rows(name, keys)
+            batches.append((name, upserts, deletes))
+
+        cls.dirty = {}
+        cls.dirty_count = 0
+        cls.flush_needed.clear()
+        return batches
 
     def load_moderators():
         try:
@@ -538,28 +872,6 @@ class BotState:
         with open(SUBSCRIBERS_FILE, "w") as f:
             json.dump(list(subs), f)
 
-    @classmethod
-    def save_meta_info(cls):
-        first_dt = cls.META_INFO.get("first_message_time", datetime.now())
-        last_dt  = cls.META_INFO.get("last_message_time",  datetime.now())
-        join_dt  = cls.META_INFO.get("join_bot_time",  datetime.now())
-
-        serializable = {
-            "afk_time": cls.META_INFO.get("afk_time", 0),
-            "alive_time": cls.META_INFO.get("alive_time", 0),
-            "messages_in_current_streak": cls.META_INFO.get("messages_in_current_streak", 0),
-            "top_streak_messages": cls.META_INFO.get("top_streak_messages", 0),
-            "user_message_counts": {
-                str(k): v for k, v in cls.META_INFO.get("user_message_counts", {}).items()
-            },
-            "first_message_time": first_dt.timestamp(),
-            "last_message_time":  last_dt.timestamp(),
-            "join_bot_time":  join_dt.timestamp(),
-        }
-
-        with open(META_FILE, "w", encoding="utf-8") as f:
-            json.dump(serializable, f, ensure_ascii=False, indent=2)
-    
     def upgrade_users_table():
         cur = db.cursor()
 
@@ -0,0 +1,54 @@
+import time
+
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries also expire `ttl` seconds after they
+    were stored. ttl=None keeps entries until they are evicted.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return self.lookup(key)[0]
+
+    def lookup(self, key):
+        """Returns (found, value), so cached None values can be told apart."""
+        item = self.data.get(key)
+        if item is None:
+            return False, None
+
+        value, expires = item
+        if expires is not None and expires < time.monotonic():
+            del self.data[key]
+            return False, None
+
+        self.data.move_to_end(key)
+        return True, value
+
+    def get(self, key, default=None):
+        found, value = self.lookup(key)
+        return value if found else default
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self.data[key] = (value, expires)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self.data.pop(key, None)
+        return item[0] if item is not None else default
+
+    def clear(self):
+        self.data.clear()
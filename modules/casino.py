@@ -135,7 +135,8 @@ async def refresh_polls(context: CallbackContext):
                 chat_id=chat,
                 message_id=msg_id,
                 media=media,
-                reply_markup=kb
+                reply_markup=kb,
+                rate_limit_args=BACKGROUND
             )
         except Exception as e:
             print(f"Failed to refresh poll {pid}: {e}")
@@ -281,6 +282,7 @@ async def finalize_giveaway(ctx: ContextTypes.DEFAULT_TYPE) -> None:
                 if cur.rowcount == 0:
                     db.execute("INSERT INTO user (id, coins) VALUES (?, ?)", (uid, coins))
             lines.append(f"• {name}: +{coins} рыженки")
+    MyBotState.rebuild_leaderboards("casino")
     
     lines.append("\n🎉 Спасибо за участие! Потратить вы можете в казино \"ЛАКИ 68\"")
     keyboard = InlineKeyboardMarkup(
@@ -325,16 +327,9 @@ async def transfer_coins(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ Нельзя перевести самому себе!")
         return
 
-    with db:
-        row = db.execute(
-            "SELECT coins FROM user WHERE id = ?",
-            (user.id,)
-        ).fetchone()
-        current = row["coins"] if row else 0
-        if current < diff:
-            await update.message.reply_text("❌ У тебя нет столько рыженки!")
-            return
-    update_coins(user.id, -diff)
+    if spend_coins(user.id, diff) is None:
+        await update.message.reply_text("❌ У тебя нет столько рыженки!")
+        return
     update_coins(target_id, diff)
 
     await update.message.reply_text(f"✅ {display_name} получил {diff} рыженки",
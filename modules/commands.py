@@ -3,6 +3,7 @@ import sys
 from .top import *
 from .updates import *
 from .casino import *
+from .persistence import *
 from .config import MyBotState
 
 from telegram import (
@@ -50,12 +51,13 @@ async def warn_use_dm(update: Update, context: CallbackContext):
     )
 
 async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text, kb = await build_stats_page_async("global", 0, context.bot)
+    text, kb = await get_stats_page("global", 0, context.bot)
     sent = await update.message.reply_text(
         text,
         parse_mode="HTML",
         reply_markup=kb
     )
+    remember_stats_page(sent.chat_id, sent.message_id, text, kb)
     MyBotState.stats_sessions[sent.message_id] = update.effective_user.id
 
 
@@ -69,10 +71,10 @@ async def shutdown_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text("🔌 Shutting down, saving stats…")
 
-    MyBotState.save_stats()
     MyBotState.save_daily_stats()
     clear_and_save_cocks()
-    MyBotState.save_meta_info()
+    await flush_state()
+    await compact_social_rating()
 
     sys.exit(0)
 
@@ -118,8 +120,7 @@ async def edit_weights_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return await msg.reply_text("ℹ️ Вторая часть должна быть числом.")
 
     # update & save
-    MyBotState.emoji_weights[key] = weight
-    MyBotState.save_emoji_weights()
+    MyBotState.set_emoji_weight(key, weight)
 
     await msg.reply_text(f"✅ Обновлено: {key} → {weight}")
 
@@ -149,8 +150,7 @@ async def ban_sc_user(update: Update, context: CallbackContext):
         await msg.reply_text(f"ℹ️ Пользователь {name} не найден в соц. рейтинге.")
         return
     
-    MyBotState.social_rating[target_id]["banned"] = True
-    MyBotState.save_social_rating()
+    MyBotState.record_rating_event("ban", target_id, delta=1)
 
     await msg.reply_text(f"✅ Пользователь {name} заблокирован в соц. рейтинге.")
 
@@ -180,8 +180,7 @@ async def unban_sc_user(update: Update, context: CallbackContext):
         await msg.reply_text(f"ℹ️ Пользователь {name} не найден в соц. рейтинге.")
         return
     
-    MyBotState.social_rating[target_id]["banned"] = False
-    MyBotState.save_social_rating()
+    MyBotState.record_rating_event("ban", target_id, delta=0)
 
     await msg.reply_text(f"✅ Пользователь {name} разблокирован в соц. рейтинге.")
 
@@ -213,20 +212,8 @@ async def change_social_rating(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ Вторым аргументом должно быть число, например +5 или -2.")
         return
 
-    if target_id not in MyBotState.social_rating:
-        MyBotState.social_rating[target_id] = {
-            "additional_chat": 0,
-            "additional_neri": 0,
-            "additional_self": 0,
-            "boosts": 0,
-            "manual_rating": 0,
-        }
-
-    old = MyBotState.social_rating[target_id]["manual_rating"]
-    MyBotState.social_rating[target_id]["manual_rating"] = old + diff
+    MyBotState.record_rating_event("manual", target_id, delta=diff)
     update_coins(target_id, diff)
-
-    MyBotState.save_social_rating()
     
     word = "получил"
     social_rating_image = SOCIAL_ADD_RATING_IMAGE
@@ -576,12 +563,13 @@ async def slot_command(update: Update, context: CallbackContext):
         stake = 10
 
     if not action_text: #and stake > 0:
-        row = db.execute(
-            "SELECT coins FROM user WHERE id = ?",
-            (user.id,)
-        ).fetchone()
-        balance = row["coins"] if row else 0
-        if balance < stake:
+        left = spend_coins(user.id, stake)
+        if left is None:
+            row = db.execute(
+                "SELECT coins FROM user WHERE id = ?",
+                (user.id,)
+            ).fetchone()
+            balance = row["coins"] if row else 0
             warning = await msg.reply_text(
                 f"❌ Недостаточно рыженки: на счету {balance}, требуется {stake}."
             )
@@ -589,7 +577,7 @@ async def slot_command(update: Update, context: CallbackContext):
             #    delete_messages_later([msg, warning], delay=5)
             #)
             return
-        update_coins(user.id, -stake)
+        balance = left + stake
 
     #if not action_text and stake == 0:
     #    warning = await msg.reply_text("❌ Ставка не может быть нулевой.")
@@ -0,0 +1,45 @@
+import re
+import unicodedata
+
+VS16 = "\uFE0F"
+CUSTOM_EMOJI_KEY = re.compile(r"<custom:(\d+)>")
+
+
+def build_emoji_table(weights: dict) -> dict:
+    """
+    Reaction key -> weight, with the spellings the reaction handler used to
+    try one by one filled in up front: the emoji as written and the form
+    with VS16 (U+FE0F) added or dropped. A spelling that is in the weights
+    itself always wins over a variant. Reactions not in NFC are looked up
+    by their NFC form once, see table_weight. Custom emoji keys
+    ("<custom:id>") are also listed under their document id.
+    """
+    table = {}
+    for key, weight in weights.items():
+        table[key] = weight
+        custom = CUSTOM_EMOJI_KEY.fullmatch(key)
+        if custom:
+            table[int(custom.group(1))] = weight
+
+    for key, weight in weights.items():
+        # a reaction whose NFC form is `key` with VS16 added or dropped
+        if key.endswith(VS16):
+            variant = key[:-1]
+            if variant.endswith(VS16):
+                continue
+        else:
+            variant = key + VS16
+        if unicodedata.is_normalized("NFC", variant):
+            table.setdefault(variant, weight)
+
+    return table
+
+def table_weight(table: dict, key) -> int:
+    weight = table.get(key)
+    if weight is None:
+        weight = 0
+        if isinstance(key, str):
+            weight = table.get(unicodedata.normalize("NFC", key), 0)
+        # only a few dozen reactions exist, remember the odd spellings too
+        table[key] = weight
+    return weight
@@ -0,0 +1,30 @@
+import asyncio
+
+
+async def fanout(recipients, send, workers: int) -> dict:
+    """
+    Calls `await send(chat_id)` for every recipient from a pool of workers.
+    Pacing and flood retries are up to the bot's PriorityRateLimiter, send
+    should pass rate_limit_args=BACKGROUND. Returns {chat_id: result or
+    exception}, one failed recipient doesn't stop the others.
+    """
+    queue = asyncio.Queue()
+    for chat_id in dict.fromkeys(recipients):
+        queue.put_nowait(chat_id)
+
+    results = {}
+
+    async def worker():
+        while True:
+            try:
+                chat_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            try:
+                results[chat_id] = await send(chat_id)
+            except Exception as e:
+                results[chat_id] = e
+
+    await asyncio.gather(*(worker() for _ in range(min(workers, queue.qsize()))))
+    return results
@@ -0,0 +1,73 @@
+class ForwardMap:
+    """
+    Copies of target messages sent to subscribers, keyed by the original
+    (chat_id, msg_id), with a subscriber -> {key: forward} reverse index.
+    Entries are kept in the order they were created, so expiring old ones
+    stops at the first entry that is still fresh.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.by_subscriber = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def items(self):
+        return self.entries.items()
+
+    def clear(self):
+        self.entries.clear()
+        self.by_subscriber.clear()
+
+    def add(self, key, entry: dict):
+        self.entries[key] = entry
+        for forward in entry["forwards"]:
+            self.by_subscriber.setdefault(forward[0], {})[key] = forward
+
+    def add_forward(self, key, forward: tuple):
+        # forward: (sub_chat, sub_msg, is_original)
+        self.entries[key]["forwards"].append(forward)
+        self.by_subscriber.setdefault(forward[0], {})[key] = forward
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return default
+
+        for forward in entry["forwards"]:
+            forwards = self.by_subscriber.get(forward[0])
+            if forwards is None:
+                continue
+            forwards.pop(key, None)
+            if not forwards:
+                del self.by_subscriber[forward[0]]
+        return entry
+
+    def forwards_of(self, sub_chat) -> list:
+        """(key, entry, forward) for every message forwarded to sub_chat."""
+        return [
+            (key, self.entries[key], forward)
+            for key, forward in self.by_subscriber.get(sub_chat, {}).items()
+        ]
+
+    def expire(self, cutoff: str) -> dict:
+        """Removes and returns entries with an ISO timestamp before cutoff."""
+        expired = {}
+        for key, entry in self.entries.items():
+            if entry.get("timestamp", "") >= cutoff:
+                break
+            expired[key] = entry
+
+        for key in expired:
+            self.pop(key)
+        return expired
@@ -0,0 +1,68 @@
+# look-alike characters people use to dodge banwords -> cyrillic letter
+HOMOGLYPHS = {
+    ord('x'): 'х', ord('X'): 'х',
+    ord('o'): 'о', ord('O'): 'о', ord('0'): 'о', ord('օ'): 'о',
+    ord('a'): 'а', ord('A'): 'а', ord('@'): 'а',
+    ord('p'): 'р', ord('P'): 'р',
+    ord('h'): 'н', ord('H'): 'н',
+    ord('t'): 'т', ord('T'): 'т',
+    ord('y'): 'у', ord('Y'): 'у',
+    ord('k'): 'к', ord('K'): 'к',
+    ord('c'): 'с', ord('C'): 'с',
+    ord('m'): 'м', ord('M'): 'м',
+    ord('e'): 'е', ord('E'): 'е',
+    ord('b'): 'в', ord('B'): 'в',
+    ord('n'): 'п', ord('N'): 'п', ord('u'): 'п', ord('U'): 'п',
+    ord('r'): 'г', ord('R'): 'г',
+    ord('3'): 'з',
+    ord('6'): 'б',
+    ord('9'): 'д',
+    ord('x'): 'х',
+    ord('X'): 'х',
+    ord('×'): 'х',
+    ord('✕'): 'х',
+    ord('❌'): 'х',
+    ord('⤫'): 'х',
+    ord('ҳ'): 'х',
+    ord('🞩'): 'х',
+    ord('χ'): 'х',
+    ord('𝔁'): 'х',
+    ord('𝕏'): 'х',
+    ord('ⅹ'): 'х',
+    ord('Ⅹ'): 'х',
+    ord('ꭓ'): 'х',
+    ord('ⲭ'): 'х',
+}
+
+# lowercase letters re.IGNORECASE takes for another letter -> that letter,
+# so exact comparison of normalized text agrees with the old regexes
+CASE_VARIANTS = {
+    ord('ı'): 'i',
+    ord('ſ'): 's',
+    ord('µ'): 'μ',
+    ord('\u0345'): 'ι', ord('\u1fbe'): 'ι',
+    ord('\u1fd3'): '\u0390',
+    ord('\u1fe3'): '\u03b0',
+    ord('ϐ'): 'β',
+    ord('ϵ'): 'ε',
+    ord('ϑ'): 'θ',
+    ord('ϰ'): 'κ',
+    ord('ϖ'): 'π',
+    ord('ϱ'): 'ρ',
+    ord('ς'): 'σ',
+    ord('ϕ'): 'φ',
+    ord('ᲀ'): 'в',
+    ord('ᲁ'): 'д',
+    ord('ᲂ'): 'о',
+    ord('ᲃ'): 'с',
+    ord('ᲄ'): 'т', ord('ᲅ'): 'т',
+    ord('ᲆ'): 'ъ',
+    ord('ᲇ'): 'ѣ',
+    ord('ᲈ'): 'ꙋ',
+    ord('ẛ'): 'ṡ',
+    ord('ﬆ'): 'ﬅ',
+}
+
+def normalize(text):
+    # lower() itself makes a final sigma, so the variants come after it
+    return text.translate(HOMOGLYPHS).lower().translate(CASE_VARIANTS)
@@ -0,0 +1,135 @@
+import io
+
+from functools import lru_cache
+
+# numpy and Pillow are imported where images are hashed, so the bot runs
+# without them as long as no image rule is ever added
+
+HASH_SIZE = 8
+# a re-encoded or slightly cropped copy stays within a few bits
+PHASH_MAX_DISTANCE = 8
+CONFIRM_MAX_DISTANCE = 10
+
+
+def load_gray(data: bytes, size: tuple):
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.seek(0)  # first frame of animated images
+        img = img.convert("RGBA")
+        # transparent stickers are compared as if shown on white
+        background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img).convert("L")
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        return np.asarray(img, dtype=np.float64)
+
+def bits_to_int(bits) -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+@lru_cache(maxsize=None)
+def dct_matrix(n: int):
+    import numpy as np
+
+    k = np.arange(n).reshape(-1, 1)
+    i = np.arange(n).reshape(1, -1)
+    return np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+
+def image_hashes(data: bytes) -> dict:
+    """
+    aHash, dHash and pHash of an image as 16-digit hex strings. CPU bound,
+    callers run it in a thread.
+    """
+    import numpy as np
+
+    small = load_gray(data, (HASH_SIZE, HASH_SIZE))
+    ahash = bits_to_int(small > small.mean())
+
+    wide = load_gray(data, (HASH_SIZE + 1, HASH_SIZE))
+    dhash = bits_to_int(wide[:, 1:] > wide[:, :-1])
+
+    pixels = load_gray(data, (HASH_SIZE * 4, HASH_SIZE * 4))
+    dct = dct_matrix(HASH_SIZE * 4)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    phash = bits_to_int(low > np.median(low))
+
+    return {
+        "ahash": f"{ahash:016x}",
+        "dhash": f"{dhash:016x}",
+        "phash": f"{phash:016x}",
+    }
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+def hash_distance(a: dict, b: dict, kind: str) -> int:
+    return hamming(int(a[kind], 16), int(b[kind], 16))
+
+def similar_images(a: dict, b: dict) -> bool:
+    # pHash decides, aHash or dHash has to agree to rule out flukes
+    return (
+        hash_distance(a, b, "phash") <= PHASH_MAX_DISTANCE
+        and min(hash_distance(a, b, "ahash"), hash_distance(a, b, "dhash")) <= CONFIRM_MAX_DISTANCE
+    )
+
+
+class BKTree:
+    """
+    Items keyed by a 64-bit hash, searchable by Hamming distance. Only the
+    subtrees that can hold close enough hashes are visited. Removed items
+    leave their node in place, it is still needed to route searches.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key: int, item):
+        self.count += 1
+        if self.root is None:
+            self.root = (key, [item], {})
+            return
+
+        node = self.root
+        while True:
+            dist = hamming(key, node[0])
+            if dist == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = (key, [item], {})
+                return
+            node = child
+
+    def remove(self, key: int, item):
+        node = self.root
+        while node is not None:
+            dist = hamming(key, node[0])
+            if dist == 0:
+                for i, other in enumerate(node[1]):
+                    if other is item:
+                        del node[1][i]
+                        self.count -= 1
+                        return
+                return
+            node = node[2].get(dist)
+
+    def search(self, key: int, max_dist: int) -> list:
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_key, items, children = stack.pop()
+            dist = hamming(key, node_key)
+            if dist <= max_dist:
+                found.extend(items)
+            for child_dist, child in children.items():
+                if dist - max_dist <= child_dist <= dist + max_dist:
+                    stack.append(child)
+        return found
@@ -187,29 +187,32 @@ async def index_users(ctx: CallbackContext) -> None:
 
     MyBotState.indexed_users.clear()
 
+    # only current members are indexed, the membership table is kept up to date
+    members = {}
     for uid in uids:
+        membership = await get_chat_membership(uid)
+        if is_chat_member(membership) and membership["joined"]:
+            members[uid] = membership
+
+    profiles = await resolve_profiles(ctx.bot, members, rate_limit_args=BACKGROUND)
+
+    for uid, membership in members.items():
         try:
             first_join_dt = to_dt(first_chat_joined_by_id.get(uid))
-            last_join_dt  = to_dt(await get_join_date(ORIG_CHANNEL_ID, uid))
-
-            if last_join_dt is None:
-                continue
+            last_join_dt  = to_dt(membership["joined"])
 
             if first_join_dt is None:
                 first_join_dt = last_join_dt
                 with db:
                     db.execute("UPDATE user SET chat_joined = ? WHERE id = ?", (int(first_join_dt.timestamp()), uid))
 
-            member = await ctx.bot.get_chat_member(ORIG_CHANNEL_ID, uid)
-            name   = parse_name(member.user)
-
             total_msgs = MyBotState.message_stats.get(uid, 0)
             daily_msgs = MyBotState.daily_stats.get(uid, 0)
 
-            cur_tot  = count_total_rating(MyBotState.social_rating,     uid)
-            cur_neri = count_neri_rating (MyBotState.social_rating,     uid)
-            old_tot  = count_total_rating(MyBotState.old_social_rating, uid)
-            old_neri = count_neri_rating (MyBotState.old_social_rating, uid)
+            cur_tot  = MyBotState.rating_totals.total(uid)
+            cur_neri = MyBotState.rating_totals.neri(uid)
+            old_tot  = MyBotState.old_rating_totals.total(uid)
+            old_neri = MyBotState.old_rating_totals.neri(uid)
 
             alias = alias_by_id.get(uid) or ""
             note  = note_by_id.get(uid)  or ""
@@ -225,6 +228,10 @@ async def index_users(ctx: CallbackContext) -> None:
                         (alias, uid)
                     )
 
+            # a failed profile lookup still lists the member, under their alias
+            uc = profiles.get(uid)
+            name = parse_name(uc) if uc is not None else html.escape(alias)
+
             MyBotState.indexed_users[uid] = {
                 "name"          : name,
                 "total_msgs"    : total_msgs,
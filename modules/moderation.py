@@ -9,54 +9,77 @@ from telegram.ext import (
 )
 
 def check_banwords(text):
-    print("len: ", len(MyBotState.patterns_))
+    # spam waves repeat the same text, remember verdicts by its digest
     norm = normalize(text)
-    #print("norm: ", norm)
-    for pat in MyBotState.patterns_:
-        if pat.search(norm):
-            return True
-    return False
+    key = hashlib.blake2b(norm.encode("utf-8"), digest_size=16).digest()
+
+    found, verdict = MyBotState.text_verdicts.lookup(key)
+    if not found:
+        verdict = MyBotState.banword_matcher.search_normalized(norm) is not None
+        MyBotState.text_verdicts.set(key, verdict)
+    return verdict
 
 def add_ban_rule(sig: dict):
-    rule = {k: v for k, v in sig.items() if v is not None}
+    rule = {k: v for k, v in sig.items() if v is not None and not k.startswith("_")}
     MyBotState.banlist.append(rule)
-    MyBotState.save_banlist()
+    MyBotState.banlist_index.add(rule)
+    MyBotState.reset_media_verdicts()
+    MyBotState.mark_dirty("banlist", ban_rule_key(rule))
 
 async def is_banned_media(sig: dict, file_id, bot):
+    uid = sig.get("file_unique_id")
+    if not uid:
+        return await check_banned_media(sig, file_id, bot)
+
+    verdicts = MyBotState.media_verdicts
+    found, verdict = verdicts.lookup(uid)
+    if not found:
+        verdict = await check_banned_media(sig, file_id, bot)
+        verdicts.set(uid, verdict)
+    return verdict
+
+async def check_banned_media(sig: dict, file_id, bot):
+    index = MyBotState.banlist_index
+
     pack = sig.get("sticker_set_name")
     print("pack: ", pack)
     if pack:
-        for rule in MyBotState.banlist:
-            if rule.get("sticker_set_name") == pack:
-                return True, rule.get("ban_type", "delete")
+        rule = index.by_sticker_set(pack) or await similar_image_rule(sig, bot)
+        if rule:
+            return True, rule.get("ban_type", "delete")
         return False, ""
 
     uid = sig.get("file_unique_id")
     if uid:
-        for rule in MyBotState.banlist:
-            if rule.get("file_unique_id") == uid:
-                return True, rule.get("ban_type", "delete")
-
-    meta_keys = ["mime_type", "duration", "width", "height", "file_size"]
-    for rule in MyBotState.banlist:
-        if all(
-            rule.get(k) is None or rule[k] == sig.get(k)
-            for k in meta_keys
-        ):
+        rule = index.by_file(uid)
+        if rule:
             return True, rule.get("ban_type", "delete")
-            rule_hash = rule.get("sha256")
-            if not rule_hash:
-                return True, rule.get("ban_type", "delete")
 
-            try:
-                sig["sha256"] = await compute_sha256(bot, file_id)
-            except:
-                return True, rule.get("ban_type", "delete")
+    # matching metadata is enough, the rule's sha256 is not compared
+    rule = index.by_meta_match(sig)
+    if rule:
+        return True, rule.get("ban_type", "delete")
 
-            return sig["sha256"] == rule_hash, rule.get("ban_type", "delete")
+    rule = await similar_image_rule(sig, bot)
+    if rule:
+        return True, rule.get("ban_type", "delete")
 
     return False, False
 
+async def similar_image_rule(sig: dict, bot):
+    # only worth downloading the image when a rule for this kind of media
+    # has one to compare to
+    if not MyBotState.banlist_index.has_image_rules(sig):
+        return None
+
+    try:
+        hashes = await media_image_hashes(bot, sig)
+    except Exception as e:
+        print(f"Failed to hash image: {e}")
+        return None
+
+    return MyBotState.banlist_index.by_image(hashes)
+
 async def ban_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await add_media_to_block(update, context, "ban")
 
@@ -103,28 +126,33 @@ async def add_media_to_block(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
     if file_id:
         try:
-            sig["sha256"] = await compute_sha256(context.bot, file_id)
+            sig["sha256"] = await media_sha256(context.bot, file_id, sig.get("file_unique_id"))
         except Exception as e:
             print(f"Failed to hash file: {e}")
 
+    try:
+        sig["image_hash"] = await media_image_hashes(context.bot, sig)
+    except Exception as e:
+        print(f"Failed to hash image: {e}")
+
     # Проверяем, нет ли уже в банлисте
-    meta_keys = ["mime_type", "duration", "width", "height", "file_size"]
-    for rule in MyBotState.banlist:
-        # 1) по названию набора стикеров
-        if sig.get("sticker_set_name") and rule.get("sticker_set_name") == sig["sticker_set_name"]:
-            await msg.reply_text("ℹ️ Этот стикер/пак уже в банлисте (по названию набора).")
-            return
-        # 2) по уникальному ID файла
-        if rule.get("file_unique_id") == sig["file_unique_id"]:
-            await msg.reply_text("ℹ️ Этот файл уже в банлисте (по уникальному ID).")
-            return
-        # 3) по остальным метаданным
-        if all(
-            rule.get(k) is None or rule[k] == sig.get(k)
-            for k in meta_keys
-        ):
-            await msg.reply_text("ℹ️ Этот файл уже в банлисте (по метаданным).")
-            return
+    reason, _ = MyBotState.banlist_index.first_match(sig)
+    # 1) по названию набора стикеров
+    if reason == "sticker_set_name":
+        await msg.reply_text("ℹ️ Этот стикер/пак уже в банлисте (по названию набора).")
+        return
+    # 2) по уникальному ID файла
+    if reason == "file_unique_id":
+        await msg.reply_text("ℹ️ Этот файл уже в банлисте (по уникальному ID).")
+        return
+    # 3) по остальным метаданным
+    if reason == "meta":
+        await msg.reply_text("ℹ️ Этот файл уже в банлисте (по метаданным).")
+        return
+    # 4) по похожему изображению
+    if reason == "image":
+        await msg.reply_text("ℹ️ Похожее изображение уже в банлисте.")
+        return
 
     sig["ban_type"] = ban_type
     add_ban_rule(sig)
@@ -168,36 +196,25 @@ async def unban_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if file_id:
         try:
-            sig["sha256"] = await compute_sha256(context.bot, file_id)
+            sig["sha256"] = await media_sha256(context.bot, file_id, sig.get("file_unique_id"))
         except Exception:
             pass
 
-    meta_keys = ["mime_type", "duration", "width", "height", "file_size"]
-    removed = 0
-    new_rules = []
-
-    for rule in MyBotState.banlist:
-        if sig.get("sticker_set_name") and rule.get("sticker_set_name") == sig["sticker_set_name"]:
-            removed += 1
-            continue
-
-        if rule.get("file_unique_id") and rule["file_unique_id"] == sig.get("file_unique_id"):
-            removed += 1
-            continue
-
-        if all(
-            rule.get(k) is None or rule[k] == sig.get(k)
-            for k in meta_keys
-        ):
-            removed += 1
-            continue
+    try:
+        sig["image_hash"] = await media_image_hashes(context.bot, sig)
+    except Exception:
+        pass
 
-        new_rules.append(rule)
+    removed = MyBotState.banlist_index.all_matches(sig)
 
     if removed:
-        MyBotState.banlist[:] = new_rules
-        MyBotState.save_banlist()
-        await msg.reply_text(f"✅ Удалено {removed} правил из банлиста.")
+        removed_ids = {id(rule) for rule in removed}
+        MyBotState.banlist[:] = [rule for rule in MyBotState.banlist if id(rule) not in removed_ids]
+        for rule in removed:
+            MyBotState.banlist_index.remove(rule)
+        MyBotState.reset_media_verdicts()
+        MyBotState.mark_dirty("banlist", *map(ban_rule_key, removed))
+        await msg.reply_text(f"✅ Удалено {len(removed)} правил из банлиста.")
     else:
         await msg.reply_text("ℹ️ Не найдено совпадающих правил в банлисте.")
 
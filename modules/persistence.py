@@ -0,0 +1,86 @@
+import asyncio
+
+from .bot_state import *
+from .config import MyBotState
+
+flush_lock = asyncio.Lock()
+
+async def flush_state():
+    async with flush_lock:
+        batches = MyBotState.take_dirty_rows()
+        events = journal.take_pending()
+        if not batches and not events:
+            return
+
+        try:
+            await asyncio.to_thread(BotState.write_state_rows, batches, events)
+        except Exception as e:
+            print(f"State flush failed, will retry: {e}")
+            for name, _, _ in batches:
+                MyBotState.mark_dirty(name)
+            journal.put_back(events)
+            return
+
+        rows = sum(len(upserts) + len(deletes or ()) for _, upserts, deletes in batches)
+        print(f"Flushed {rows} state rows in {len(batches)} collections, {len(events)} rating events")
+
+async def compact_social_rating(context=None):
+    async with flush_lock:
+        upserts, deletes, seq = MyBotState.take_rating_snapshot()
+        events = journal.take_pending()
+        if deletes is not None and not upserts and not deletes and not events:
+            return
+
+        try:
+            await asyncio.to_thread(journal.write_snapshot, upserts, deletes, seq, events)
+        except Exception as e:
+            print(f"Social rating compaction failed, will retry: {e}")
+            journal.replace_all = True
+            journal.put_back(events)
+            return
+
+        print(f"Social rating snapshot at event #{seq} ({len(upserts)} users)")
+
+async def evict_old_forwards(context=None):
+    async with flush_lock:
+        rows = MyBotState.expire_forwards()
+        if not rows:
+            return
+
+        try:
+            await asyncio.to_thread(BotState.move_cold_forwards, rows)
+        except Exception as e:
+            # the rows stay in the hot table and are moved on the next start
+            print(f"Moving old forwards failed: {e}")
+            return
+
+        MyBotState.cold_forward_keys.update(rows)
+        print(f"Moved {len(rows)} old forwards to cold storage")
+
+async def state_flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(MyBotState.flush_needed.wait(), STATE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            await flush_state()
+        except Exception as e:
+            print(f"exception in state_flush_loop: {e}")
+
+async def start_state_flusher(app):
+    app.bot_data["state_flusher"] = asyncio.create_task(state_flush_loop())
+
+async def stop_state_flusher(app):
+    task = app.bot_data.pop("state_flusher", None)
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    await flush_state()
+    await compact_social_rating()
+    print("State flushed on shutdown.")
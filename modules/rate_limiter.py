@@ -0,0 +1,256 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# request priorities, lower goes first
+MODERATION = 0
+INTERACTIVE = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {MODERATION: "moderation", INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# requests without rate_limit_args get their priority from the endpoint
+MODERATION_ENDPOINTS = {
+    "deleteMessage",
+    "deleteMessages",
+    "restrictChatMember",
+    "banChatMember",
+    "banChatSenderChat",
+}
+# only messages count against the per-chat limit
+CHAT_LIMITED_PREFIXES = ("send", "copy", "forward", "edit", "stopPoll")
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, up to `capacity` saved up. A pause can push
+    the tokens below zero, the bucket is then empty until they are repaid.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        # seconds until a whole token is there
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, delay: float):
+        # nobody gets a token for the next `delay` seconds
+        self.refill()
+        self.tokens = min(self.tokens, -delay * self.rate)
+
+
+def retry_delay(e: RetryAfter) -> float:
+    delay = e.retry_after
+    if isinstance(delay, timedelta):
+        delay = delay.total_seconds()
+    return float(delay)
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    Every Bot API request of the app goes through here. All requests queue
+    for the global bucket, and whenever a token is free the most urgent
+    waiter gets it: spam deletion and bans, then replies to users, then
+    background work (broadcasts, edits of forwards, poll refreshes), which
+    passes rate_limit_args=BACKGROUND. Messages also need a token of their
+    chat's bucket, taken together with the global one, so a waiter whose
+    chat is at its limit is passed over and a reply to a busy group still
+    goes before the background edits queued for it. A RetryAfter pauses the
+    global bucket and the request is tried again, up to max_retries times.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        private_chat_rate: float,
+        group_chat_rate: float,
+        group_chat_burst: float,
+        max_retries: int = 3,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.group_chat_burst = group_chat_burst
+        self.chat_buckets = {}
+        self.max_retries = max_retries
+
+        # heap of (priority, order, future, chat bucket or None)
+        self.waiting = []
+        self.order = itertools.count()
+        self.dispatcher = None
+        self.wakeup = asyncio.Event()
+
+        self.queued = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.peak = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.sent = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.retries = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.waited = dict.fromkeys(PRIORITY_NAMES, 0.0)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+        for _, _, fut, _ in self.waiting:
+            fut.cancel()
+        self.waiting.clear()
+
+    def stats(self) -> dict:
+        """Queue depth and counters per priority."""
+        return {
+            name: {
+                "queued": self.queued[p],
+                "peak": self.peak[p],
+                "sent": self.sent[p],
+                "retries": self.retries[p],
+                "avg_wait": self.waited[p] / self.sent[p] if self.sent[p] else 0.0,
+            }
+            for p, name in PRIORITY_NAMES.items()
+        }
+
+    def priority_of(endpoint: str, rate_limit_args) -> int:
+        if rate_limit_args is not None:
+            return rate_limit_args
+        if endpoint in MODERATION_ENDPOINTS:
+            return MODERATION
+        return INTERACTIVE
+
+    def chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if str(chat_id).startswith("-"):
+                bucket = TokenBucket(self.group_chat_rate, self.group_chat_burst)
+            else:
+                bucket = TokenBucket(self.private_chat_rate)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def drop_idle_buckets(self):
+        # a full bucket is the same as a new one
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity:
+                del self.chat_buckets[chat_id]
+
+    async def acquire(self, priority: int, bucket=None):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.order), fut, bucket))
+        self.queued[priority] += 1
+        self.peak[priority] = max(self.peak[priority], self.queued[priority])
+
+        if self.dispatcher is None:
+            self.dispatcher = asyncio.create_task(self.dispatch())
+        else:
+            self.wakeup.set()
+
+        try:
+            await fut
+        finally:
+            self.queued[priority] -= 1
+
+    async def dispatch(self):
+        try:
+            while self.waiting:
+                delay = self.global_bucket.wait_time()
+                if delay > 0:
+                    # the waiter is picked after the sleep, so a more
+                    # urgent request that comes in meanwhile goes first
+                    await asyncio.sleep(delay)
+                    continue
+
+                entry, chat_delay = self.next_ready()
+                if entry is None:
+                    if not self.waiting:
+                        break
+                    # every waiter's chat is at its limit, sleep until the
+                    # first one has a token or another request comes in
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), chat_delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                _, _, fut, bucket = entry
+                self.global_bucket.take()
+                if bucket is not None:
+                    bucket.take()
+                fut.set_result(None)
+        finally:
+            self.dispatcher = None
+
+        if len(self.chat_buckets) > 1000:
+            self.drop_idle_buckets()
+
+    def next_ready(self):
+        """
+        Pops the most urgent waiter that can go now, putting back the ones
+        whose chat has no token. Returns it (or None) and the seconds until
+        the first of those chats has a token.
+        """
+        blocked = []
+        found = None
+        chat_delay = None
+        while self.waiting:
+            entry = heapq.heappop(self.waiting)
+            fut, bucket = entry[2], entry[3]
+            if fut.done():
+                # the caller gave up waiting
+                continue
+            if bucket is not None:
+                wait = bucket.wait_time()
+                if wait > 0:
+                    blocked.append(entry)
+                    chat_delay = wait if chat_delay is None else min(chat_delay, wait)
+                    continue
+            found = entry
+            break
+
+        for entry in blocked:
+            heapq.heappush(self.waiting, entry)
+        return found, chat_delay
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = PriorityRateLimiter.priority_of(endpoint, rate_limit_args)
+        chat_id = data.get("chat_id")
+        chat_limited = chat_id is not None and endpoint.startswith(CHAT_LIMITED_PREFIXES)
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            # moderation doesn't wait for the chat, deleting spam is not a message
+            bucket = None
+            if chat_limited and priority != MODERATION:
+                bucket = self.chat_bucket(chat_id)
+            await self.acquire(priority, bucket)
+            self.waited[priority] += time.monotonic() - started
+            self.sent[priority] += 1
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_delay(e)
+                self.retries[priority] += 1
+                print(f"Flood limit on {endpoint}, retry in {delay}s, queue: {self.queued}")
+                self.global_bucket.pause(delay)
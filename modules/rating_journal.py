@@ -0,0 +1,181 @@
+import time
+
+from datetime import datetime
+
+# kind of event -> what it does to the author's entry:
+#   create  - makes sure the entry exists
+#   react   - reactor_counts[reactor] gets one more counted reaction and delta value
+#   neri    - additional_neri += delta
+#   self    - additional_self += delta
+#   manual  - manual_rating += delta
+#   boosts  - boosts = delta
+#   ban     - banned = bool(delta)
+#   reset   - the whole rating is cleared (monthly reset)
+
+def new_rating_entry() -> dict:
+    return {
+        "reactor_counts":  {},
+        "banned":          False,
+        "total_reacts":    0,
+        "additional_chat": 0,
+        "additional_neri": 0,
+        "additional_self": 0,
+        "boosts":          0,
+        "manual_rating":   0,
+    }
+
+def apply_rating_event(sr: dict, kind: str, author_id, reactor_id=None, delta: int = 0):
+    if kind == "reset":
+        sr.clear()
+        return
+
+    entry = sr.setdefault(author_id, new_rating_entry())
+    for key, default in new_rating_entry().items():
+        entry.setdefault(key, default)
+
+    if kind == "react":
+        rc = entry["reactor_counts"]
+        reactor_data = rc.setdefault(reactor_id, {"count": 0, "value": 0})
+        reactor_data["count"] += 1
+        reactor_data["value"] += delta
+        entry["total_reacts"] = sum(d["count"] for d in rc.values())
+    elif kind == "neri":
+        entry["additional_neri"] += delta
+    elif kind == "self":
+        entry["additional_self"] += delta
+    elif kind == "manual":
+        entry["manual_rating"] += delta
+    elif kind == "boosts":
+        entry["boosts"] = delta
+    elif kind == "ban":
+        entry["banned"] = bool(delta)
+
+class RatingJournal:
+    """
+    Append-only log of social rating events stored next to the rating
+    snapshot. The snapshot remembers the last event it contains, so a
+    restart only replays the tail written after it.
+
+    Events get their seq in memory and are written in batches by the state
+    flusher (take_pending/write_events), never on the event loop. Events
+    already in a snapshot are kept for `retention` seconds, long enough
+    for rebuild() to restore a month, and deleted after that.
+    """
+
+    def __init__(self, store, retention: float):
+        self.store = store
+        self.retention = retention
+        store.ensure_collection("social_rating")
+        with store.lock, store.conn:
+            store.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rating_journal (
+                    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts         REAL    NOT NULL,
+                    kind       TEXT    NOT NULL,
+                    author_id  INTEGER,
+                    reactor_id INTEGER,
+                    delta      INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            store.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_rating_journal_ts
+                ON rating_journal(ts)
+            """)
+            store.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rating_snapshot (
+                    id  INTEGER PRIMARY KEY CHECK (id = 0),
+                    seq INTEGER NOT NULL
+                )
+            """)
+            row = store.conn.execute("SELECT MAX(seq) FROM rating_journal").fetchone()
+
+        # the journal can be trimmed down to nothing, the snapshot still
+        # knows the last seq handed out
+        self.last_seq = max(row[0] or 0, self.snapshot_seq())
+        # (seq, ts, kind, author_id, reactor_id, delta) not written yet
+        self.pending = []
+        # authors changed since the last snapshot; replace_all after a reset
+        self.dirty = set()
+        self.replace_all = False
+
+    def append(self, kind: str, author_id=None, reactor_id=None, delta: int = 0) -> int:
+        self.last_seq += 1
+        self.pending.append(
+            (self.last_seq, time.time(), kind, author_id, reactor_id, int(delta))
+        )
+        return self.last_seq
+
+    def take_pending(self) -> list:
+        events, self.pending = self.pending, []
+        return events
+
+    def put_back(self, events: list):
+        # events whose write failed go before anything appended since
+        self.pending[:0] = events
+
+    def insert_events(self, events: list):
+        # caller holds the store lock and the transaction
+        self.store.conn.executemany(
+            "INSERT INTO rating_journal (seq, ts, kind, author_id, reactor_id, delta) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            events
+        )
+
+    def write_events(self, events: list):
+        with self.store.lock, self.store.conn:
+            self.insert_events(events)
+
+    def snapshot_seq(self) -> int:
+        with self.store.lock:
+            row = self.store.conn.execute(
+                "SELECT seq FROM rating_snapshot WHERE id = 0"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def tail(self, after_seq: int) -> list:
+        with self.store.lock:
+            return self.store.conn.execute(
+                "SELECT kind, author_id, reactor_id, delta FROM rating_journal "
+                "WHERE seq > ? ORDER BY seq",
+                (after_seq,)
+            ).fetchall()
+
+    def write_snapshot(self, upserts: dict, deletes, seq: int, events=()):
+        # deletes=None means the snapshot replaces the whole table; `events`
+        # are the pending events up to seq, written in the same transaction
+        with self.store.lock, self.store.conn:
+            if events:
+                self.insert_events(events)
+            if deletes is None:
+                self.store.clear_rows("social_rating")
+            elif deletes:
+                self.store.delete_rows("social_rating", deletes)
+            if upserts:
+                self.store.upsert_rows("social_rating", upserts)
+            self.store.conn.execute(
+                "INSERT INTO rating_snapshot (id, seq) VALUES (0, ?) "
+                "ON CONFLICT(id) DO UPDATE SET seq = excluded.seq",
+                (seq,)
+            )
+            self.store.conn.execute(
+                "DELETE FROM rating_journal WHERE seq <= ? AND ts < ?",
+                (seq, time.time() - self.retention)
+            )
+
+    def rebuild(self, since: datetime, until: datetime) -> dict:
+        """
+        Replays the events of [since, until) into a fresh rating, e.g. to
+        restore one month. Boosts and bans set before `since` are not seen,
+        and neither are events older than the retention.
+        """
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                "SELECT kind, author_id, reactor_id, delta FROM rating_journal "
+                "WHERE ts >= ? AND ts < ? ORDER BY seq",
+                (since.timestamp(), until.timestamp())
+            ).fetchall()
+
+        sr = {}
+        for kind, author_id, reactor_id, delta in rows:
+            apply_rating_event(sr, kind, author_id, reactor_id, delta)
+        return sr
@@ -0,0 +1,97 @@
+class RatingTotals:
+    """
+    Per-user total and neri rating of one social rating dict, kept up to
+    date from rating events instead of being recounted on every read.
+
+    total = additional_chat + neri + sum of values from reactors that are
+    not banned, neri = additional_neri * 15 + boosts * 5 + manual_rating.
+    """
+
+    def __init__(self):
+        self.neri_by_uid = {}
+        self.chat_by_uid = {}
+        self.reacted_by_uid = {}
+        self.authors_by_reactor = {}
+        self.banned = set()
+
+    def rebuild(self, sr: dict):
+        self.neri_by_uid.clear()
+        self.chat_by_uid.clear()
+        self.reacted_by_uid.clear()
+        self.authors_by_reactor.clear()
+        self.banned = {uid for uid, info in sr.items() if info.get("banned", False)}
+
+        for uid, info in sr.items():
+            self.refresh_base(uid, info)
+            reacted = 0
+            for rid, entry in info.get("reactor_counts", {}).items():
+                self.authors_by_reactor.setdefault(rid, set()).add(uid)
+                if rid not in self.banned:
+                    reacted += entry.get("value", 0)
+            self.reacted_by_uid[uid] = reacted
+
+    def refresh_base(self, uid, info: dict):
+        self.chat_by_uid[uid] = info.get("additional_chat", 0)
+        self.neri_by_uid[uid] = (
+            info.get("additional_neri", 0) * 15
+            + info.get("boosts", 0) * 5
+            + info.get("manual_rating", 0)
+        )
+
+    def total(self, uid) -> int:
+        return (
+            self.chat_by_uid.get(uid, 0)
+            + self.neri_by_uid.get(uid, 0)
+            + self.reacted_by_uid.get(uid, 0)
+        )
+
+    def neri(self, uid) -> int:
+        return self.neri_by_uid.get(uid, 0)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self.neri_by_uid
+
+    def on_event(self, sr: dict, kind: str, author_id, reactor_id=None, delta: int = 0) -> set:
+        """
+        Applies an already applied rating event to the totals and returns
+        the uids whose total changed.
+        """
+        if kind == "reset":
+            changed = set(self.neri_by_uid)
+            self.rebuild(sr)
+            return changed
+
+        info = sr[author_id]
+        if author_id not in self.neri_by_uid:
+            self.refresh_base(author_id, info)
+        self.reacted_by_uid.setdefault(author_id, 0)
+
+        if kind == "react":
+            self.authors_by_reactor.setdefault(reactor_id, set()).add(author_id)
+            if reactor_id not in self.banned:
+                self.reacted_by_uid[author_id] += delta
+            return {author_id}
+
+        if kind == "ban":
+            # the banned user is the author of the event, but their reactions
+            # to other authors are what changes
+            banned = bool(delta)
+            if banned == (author_id in self.banned):
+                return set()
+
+            sign = -1 if banned else 1
+            if banned:
+                self.banned.add(author_id)
+            else:
+                self.banned.discard(author_id)
+
+            changed = set()
+            for uid in self.authors_by_reactor.get(author_id, ()):
+                entry = sr.get(uid, {}).get("reactor_counts", {}).get(author_id)
+                if entry:
+                    self.reacted_by_uid[uid] += sign * entry.get("value", 0)
+                    changed.add(uid)
+            return changed
+
+        self.refresh_base(author_id, info)
+        return {author_id}
@@ -0,0 +1,25 @@
+from telethon import events
+from telethon.tl.types import UpdateBotMessageReaction
+
+
+class ReactionUpdates(events.Raw):
+    """
+    Raw event that only exists for UpdateBotMessageReaction. Telethon
+    builds every registered event type once per update, and an update this
+    returns None for is dropped before any handler is called.
+    """
+
+    processed = 0
+    dropped = 0
+
+    @classmethod
+    def build(cls, update, others=None, self_id=None):
+        if isinstance(update, UpdateBotMessageReaction):
+            cls.processed += 1
+            return update
+        cls.dropped += 1
+        return None
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {"processed": cls.processed, "dropped": cls.dropped}
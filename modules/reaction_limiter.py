@@ -0,0 +1,46 @@
+from collections import deque
+
+
+class ReactionLimiter:
+    """
+    Sliding-window limits on counted reactions, per reactor. Each reactor
+    has a ring buffer with the epoch seconds of their last `history` counted
+    reactions, newest last. A limit (count, seconds, min_history) turns a
+    reaction down when the reactor has at least min_history reactions on
+    record and the count-th newest of them is less than `seconds` old, so
+    every check looks at one item of the buffer.
+    """
+
+    def __init__(self, limits, history: int):
+        self.limits = limits
+        self.history = history
+        # uid -> deque of epoch seconds, also the rows of the state store
+        self.times = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def check(self, uid, now: float):
+        """The first limit uid would break by reacting at `now`, or None."""
+        times = self.times.get(uid)
+        if not times:
+            return None
+
+        for limit in self.limits:
+            count, seconds, min_history = limit
+            if len(times) >= max(count, min_history) and now - times[-count] < seconds:
+                return limit
+        return None
+
+    def record(self, uid, now: float):
+        times = self.times.get(uid)
+        if times is None:
+            times = self.times[uid] = deque(maxlen=self.history)
+        times.append(now)
+
+    def load(self, uid, stamps):
+        # stamps in any order, only the newest `history` are kept
+        self.times[uid] = deque(sorted(stamps)[-self.history:], maxlen=self.history)
+
+    def clear(self):
+        self.times.clear()
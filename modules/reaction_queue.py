@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+
+class ReactionQueue:
+    """
+    Collects reaction updates and hands them to `process(batch)` in
+    batches. Updates with the same key (chat, message, actor) that come
+    within `delay` seconds of the first one are merged into one: the
+    reactions before the first and after the last, so toggling a reaction
+    back and forth ends up as a single change or none at all. The batch
+    is a list of (key, old reactions, new reactions).
+    """
+
+    def __init__(self, process, delay: float, max_batch: int):
+        self.process = process
+        self.delay = delay
+        self.max_batch = max_batch
+        # key -> [first seen, old, new], in the order the keys came
+        self.pending = {}
+        self.task = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, key, old, new):
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [time.monotonic(), old, new]
+        else:
+            entry[2] = new
+
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def take_due(self, now: float) -> list:
+        batch = []
+        for key, (seen, old, new) in self.pending.items():
+            if seen > now - self.delay or len(batch) >= self.max_batch:
+                break
+            batch.append((key, old, new))
+        for key, _, _ in batch:
+            del self.pending[key]
+        return batch
+
+    async def run(self):
+        try:
+            while self.pending:
+                oldest = next(iter(self.pending.values()))[0]
+                wait = oldest + self.delay - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                batch = self.take_due(time.monotonic())
+                if not batch:
+                    continue
+                try:
+                    await self.process(batch)
+                except Exception as e:
+                    print(f"Failed to process {len(batch)} reactions: {e}")
+        finally:
+            self.task = None
+
+    async def flush(self):
+        """Processes everything that is pending right away."""
+        while self.pending:
+            batch = self.take_due(float("inf"))
+            try:
+                await self.process(batch)
+            except Exception as e:
+                print(f"Failed to process {len(batch)} reactions: {e}")
+
+        # a batch the background task already took
+        if self.task is not None:
+            await self.task
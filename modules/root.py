@@ -3,6 +3,9 @@ import re
 
 from .moderation import *
 from .config import MyBotState
+from .fanout import fanout
+from .rate_limiter import PriorityRateLimiter
+from .reaction_events import ReactionUpdates
 
 from telegram.error import BadRequest, Forbidden, TimedOut
 from telegram import (
@@ -21,6 +24,10 @@ async def handle_cocksize(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not user:
         return
 
+    remember_user(user)
+    remember_chat(update.effective_chat)
+    remember_message(msg)
+
     text = msg.text or msg.caption or ""
     if check_banwords(text) and user.id != TARGET_USER:
         print("We got blocked text!")
@@ -128,13 +135,19 @@ async def handle_cocksize(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for member in msg.new_chat_members:
             user_id = member.id
             print(f"New user joined: {user_id} ({member.username})")
+            remember_user(member)
+            set_chat_member(user_id, "member", msg.date.timestamp())
+            record_first_join(user_id, msg.date.timestamp())
             if user_id in MyBotState.SUBSCRIBERS:
                 await update_all_messages(context.bot, user_id)
     
     print(update)
 
     MyBotState.message_stats[user.id] = MyBotState.message_stats.get(user.id, 0) + 1
+    MyBotState.mark_dirty("message_stats", user.id)
     MyBotState.daily_stats[user.id] = MyBotState.daily_stats.get(user.id, 0) + 1
+    MyBotState.refresh_leaderboard("global", user.id)
+    MyBotState.refresh_leaderboard("daily", user.id)
     
     fd = getattr(msg, "forward_date", None)
     if fd is None and hasattr(msg, "api_kwargs"):
@@ -148,27 +161,18 @@ async def handle_cocksize(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 size = float(m.group(1))
                 ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
                 MyBotState.last_sizes[user.id] = {"size": size, "ts": ts}
-                MyBotState.save_last_sizes()
+                MyBotState.mark_dirty("last_sizes", user.id)
+                MyBotState.refresh_leaderboard("cock", user.id)
 
     if not user.id in MyBotState.social_rating:
-        MyBotState.social_rating[user.id] = {
-            "reactor_counts": {},
-            "total_reacts":    0,
-            "additional_chat": 0,
-            "additional_neri": 0,
-            "additional_self": 0,
-            "boosts":          0,
-            "manual_rating":   0,
-        }
-        MyBotState.save_social_rating()
+        MyBotState.record_rating_event("create", user.id)
 
     bc = getattr(msg, "sender_boost_count", None)
     if bc is None and hasattr(msg, "api_kwargs"):
         bc = msg.api_kwargs.get("sender_boost_count", 0)
     boost_count = int(bc or 0)
     if MyBotState.social_rating[user.id]["boosts"] != boost_count:
-        MyBotState.social_rating[user.id]["boosts"] = boost_count
-        MyBotState.save_social_rating()
+        MyBotState.record_rating_event("boosts", user.id, delta=boost_count)
     
     await check_afk_time(context.bot, user, update.effective_chat.id)
 
@@ -230,7 +234,7 @@ async def handle_cocksize(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await broadcast(orig_chat, orig_msg, text, has_media, context.bot)
 
-    MyBotState.save_forward_map()
+    MyBotState.mark_dirty("forward_map", (orig_chat, orig_msg))
     
     via = update.message.via_bot
     if not (via and via.username == COCKBOT_USERNAME):
@@ -255,49 +259,91 @@ async def handle_cocksize(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_to_message_id=update.message.message_id
     )
 
+request_limiter = PriorityRateLimiter(
+    API_GLOBAL_RATE,
+    API_PRIVATE_CHAT_RATE,
+    API_GROUP_CHAT_RATE,
+    API_GROUP_CHAT_BURST,
+    max_retries=API_MAX_RETRIES,
+)
+
+async def queue_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or user.id not in MyBotState.MODERATORS:
+        return
+
+    lines = ["📬 Очередь запросов к Telegram:"]
+    for name, s in request_limiter.stats().items():
+        lines.append(
+            f"{name}: в очереди {s['queued']} (макс. {s['peak']}), "
+            f"отправлено {s['sent']}, повторов {s['retries']}, "
+            f"ожидание {s['avg_wait']:.2f} с"
+        )
+
+    reactions = ReactionUpdates.stats()
+    lines.append(
+        f"\n🔥 Обновления Telethon: реакций {reactions['processed']}, "
+        f"пропущено {reactions['dropped']}"
+    )
+    await update.message.reply_text("\n".join(lines))
+
+# (orig_chat, orig_msg) -> (version, text, has_media) of the latest edit
+latest_edits = {}
+# (orig_chat, orig_msg) -> task propagating latest_edits to the forwards
+edit_tasks = {}
+
 async def broadcast(orig_chat_id, orig_msg_id, text, has_media, bot):
     kb = await make_link_keyboard(orig_chat_id, orig_msg_id, bot)
     join_chat = await make_chat_invite_keyboard()
 
-    if (orig_chat_id, orig_msg_id) not in MyBotState.forward_map:
-        MyBotState.forward_map[(orig_chat_id, orig_msg_id)] = {
+    key = (orig_chat_id, orig_msg_id)
+    if key not in MyBotState.forward_map:
+        MyBotState.forward_map.add(key, {
             "text": text,
             "has_media": has_media,
             "forwards": [],
+            "failed": [],
             "timestamp": datetime.utcnow().isoformat()
-        }
+        })
+    entry = MyBotState.forward_map[key]
 
-    mention_list = []
-    for subscriber_id in list(MyBotState.SUBSCRIBERS):
-        print('Forwarding!')
-        try:
-            member = await bot.get_chat_member(orig_chat_id, subscriber_id)
-            print(member)
-        except BadRequest:
-            print("Bad Requesst")
-            return
-        
-        try:
-            if member.status in ("left", "kicked"):
-                fwd = await bot.send_message(
-                    chat_id=subscriber_id,
-                    text="Рыжопеч опубликовала новое сообщение в чате, но вы должны быть его участником, чтобы видеть содержимое!",
-                    reply_markup=join_chat
-                )
-                MyBotState.forward_map[(orig_chat_id, orig_msg_id)]["forwards"].append((subscriber_id, fwd.message_id, False))
-                continue
+    async def deliver(subscriber_id):
+        membership = await get_chat_membership(subscriber_id)
 
+        if not is_chat_member(membership):
+            fwd = await bot.send_message(
+                chat_id=subscriber_id,
+                text="Рыжопеч опубликовала новое сообщение в чате, но вы должны быть его участником, чтобы видеть содержимое!",
+                reply_markup=join_chat,
+                rate_limit_args=BACKGROUND
+            )
+            forward = (subscriber_id, fwd.message_id, False)
+        else:
             fwd = await bot.copy_message(
                 chat_id=subscriber_id,
                 from_chat_id=orig_chat_id,
                 message_id=orig_msg_id,
-                reply_markup=kb
+                reply_markup=kb,
+                rate_limit_args=BACKGROUND
             )
-            MyBotState.forward_map[(orig_chat_id, orig_msg_id)]["forwards"].append((subscriber_id, fwd.message_id, True))
+            forward = (subscriber_id, fwd.message_id, True)
+
+        # added right away so edits that come during the broadcast see it
+        MyBotState.forward_map.add_forward(key, forward)
+        return forward
+
+    print(f"Forwarding to {len(MyBotState.SUBSCRIBERS)} subscribers")
+    results = await fanout(list(MyBotState.SUBSCRIBERS), deliver, workers=FANOUT_WORKERS)
+
+    mention_list = []
+    for subscriber_id, result in results.items():
+        if not isinstance(result, Exception):
+            continue
+
+        entry["failed"].append((subscriber_id, type(result).__name__))
 
-        except Forbidden:
-            MyBotState.SUBSCRIBERS.remove(subscriber_id)
-            BotState.save_subscribers(MyBotState.SUBSCRIBERS)
+        if isinstance(result, Forbidden):
+            MyBotState.SUBSCRIBERS.discard(subscriber_id)
             print(f"Removed {subscriber_id}: never initiated conversation")
             try:
                 chat = await bot.get_chat(subscriber_id)
@@ -310,15 +356,19 @@ async def broadcast(orig_chat_id, orig_msg_id, text, has_media, bot):
                 mention = str(subscriber_id)
             
             mention_list.append(mention)
-            
-
-        except TimedOut:
+        elif isinstance(result, TimedOut):
             print(f"Forward to {subscriber_id} timed out; skipping")
+        elif isinstance(result, BadRequest):
+            print(f"Bad request forwarding to {subscriber_id}: {result}")
+        else:
+            print(f"Unexpected error forwarding to {subscriber_id}: {result}")
+
+    failed = sum(isinstance(r, Exception) for r in results.values())
+    print(f"Broadcast of {orig_msg_id}: {len(results) - failed} delivered, {failed} failed")
 
-        except Exception:
-            print(f"Unexpected error forwarding to {subscriber_id}")
-    
     if mention_list:
+        BotState.save_subscribers(MyBotState.SUBSCRIBERS)
+
         unique = list(dict.fromkeys(mention_list))
         mentions = ", ".join(unique)
         text = (
@@ -338,12 +388,7 @@ async def broadcast(orig_chat_id, orig_msg_id, text, has_media, bot):
 async def update_all_messages(bot, user_id):
     now = datetime.utcnow()
 
-    for (orig_id, orig_msg), entry in MyBotState.forward_map.items():
-        forwards = entry["forwards"]
-        user_forward = next((fwd for fwd in entry["forwards"] if fwd[0] == user_id), None)
-        if not user_forward:
-            continue
-
+    for (orig_id, orig_msg), entry, user_forward in MyBotState.forward_map.forwards_of(user_id):
         timestamp_str = entry.get("timestamp")
         if not timestamp_str:
             print(f"Skipping message {orig_msg}: no timestamp")
@@ -373,8 +418,9 @@ async def update_all_messages(bot, user_id):
 
     print(f"Update complete for user {user_id}")
 
-async def edit_message(bot, sub_chat, sub_msg, orig_id, orig_msg, new_text, has_media):
-    kb = await make_link_keyboard(orig_id, orig_msg, bot)
+async def edit_message(bot, sub_chat, sub_msg, orig_id, orig_msg, new_text, has_media, kb=None):
+    if kb is None:
+        kb = await make_link_keyboard(orig_id, orig_msg, bot)
     try:
         if has_media:
             await bot.edit_message_caption(
@@ -382,7 +428,8 @@ async def edit_message(bot, sub_chat, sub_msg, orig_id, orig_msg, new_text, has_
                 message_id=sub_msg,
                 caption=new_text,
                 parse_mode=constants.ParseMode.HTML,
-                reply_markup=kb
+                reply_markup=kb,
+                rate_limit_args=BACKGROUND
             )
         else:
             await bot.edit_message_text(
@@ -390,7 +437,8 @@ async def edit_message(bot, sub_chat, sub_msg, orig_id, orig_msg, new_text, has_
                 message_id=sub_msg,
                 text=new_text,
                 parse_mode=constants.ParseMode.HTML,
-                reply_markup=kb
+                reply_markup=kb,
+                rate_limit_args=BACKGROUND
             )
     except BadRequest as e:
         print(f"Couldn't edit message {sub_msg} in chat {sub_chat}: {e}")
@@ -402,42 +450,94 @@ async def edit_forwards(bot, event, orig_id, orig_msg):
     has_media = msg.media is not None
 
     key = (orig_id, orig_msg)
-    entry = MyBotState.forward_map.get(key)
-    if not entry:
+    # almost every edit is of a message that was never forwarded
+    if not MyBotState.is_forwarded(key):
         return
 
-    for sub_chat, sub_msg, is_original in entry["forwards"]:
-        print(f"Editing message {sub_msg} for user {sub_chat}")
+    version = latest_edits.get(key, (0,))[0] + 1
+    latest_edits[key] = (version, new_text, has_media)
 
-        if not is_original:
-            print(f"Skipping non-original message for {sub_chat}")
-            continue
+    # a running propagation picks the new text up, no need for another one
+    if key not in edit_tasks:
+        edit_tasks[key] = asyncio.create_task(propagate_edits(bot, key))
 
-        try:
-            await edit_message(bot, sub_chat, sub_msg, orig_id, orig_msg, new_text, has_media)
-        except Exception as e:
-            print(f"Failed to edit message {sub_msg} in {sub_chat}: {e}")
+async def propagate_edits(bot, key):
+    orig_id, orig_msg = key
+    try:
+        await asyncio.sleep(EDIT_COALESCE_DELAY)
+
+        entry = MyBotState.forward_map.get(key)
+        if entry is None and MyBotState.is_forwarded(key):
+            entry = await asyncio.to_thread(BotState.cold_forward_entry, key)
+        if not entry:
+            return
+
+        kb = await make_link_keyboard(orig_id, orig_msg, bot)
+        sub_msgs = {sub_chat: sub_msg for sub_chat, sub_msg, is_original in entry["forwards"] if is_original}
+        applied = {}
+
+        async def send(sub_chat):
+            version, new_text, has_media = latest_edits[key]
+            applied[sub_chat] = version
+            await edit_message(bot, sub_chat, sub_msgs[sub_chat], orig_id, orig_msg, new_text, has_media, kb)
+
+        # repeat until every copy got the latest version, edits that came
+        # in the meantime only reach the copies that were already done
+        while True:
+            version = latest_edits[key][0]
+            targets = [sub_chat for sub_chat in sub_msgs if applied.get(sub_chat) != version]
+            if not targets:
+                break
+
+            print(f"Editing {len(targets)} forwards of {orig_msg} (edit #{version})")
+            results = await fanout(targets, send, workers=FANOUT_WORKERS)
+            for sub_chat, result in results.items():
+                if isinstance(result, Exception):
+                    print(f"Failed to edit message {sub_msgs[sub_chat]} in {sub_chat}: {result}")
+    finally:
+        latest_edits.pop(key, None)
+        edit_tasks.pop(key, None)
 
 async def delete_forwards(bot, orig_chat, orig_msg):
     key = (orig_chat, orig_msg)
+
+    task = edit_tasks.get(key)
+    if task:
+        task.cancel()
+
+    if not MyBotState.is_forwarded(key):
+        return
+
     entry = MyBotState.forward_map.get(key)
+    cold = entry is None
+    if cold:
+        entry = await asyncio.to_thread(BotState.cold_forward_entry, key)
 
     if not entry:
         return
 
-    for sub_chat, sub_msg, _ in entry["forwards"]:
-        print(f"Deleting message {sub_msg} in chat {sub_chat}")
-        try:
-            await bot.delete_message(
-                chat_id=sub_chat,
-                message_id=sub_msg
-            )
-        except BadRequest:
-            print("Couldn't delete message")
-        except Exception as e:
-            print(f"Unexpected error deleting message: {e}")
+    sub_msgs = {sub_chat: sub_msg for sub_chat, sub_msg, _ in entry["forwards"]}
 
-    MyBotState.forward_map.pop(key, None)
+    async def send(sub_chat):
+        await bot.delete_message(
+            chat_id=sub_chat,
+            message_id=sub_msgs[sub_chat],
+            rate_limit_args=BACKGROUND
+        )
+
+    print(f"Deleting {len(sub_msgs)} forwards of {orig_msg}")
+    results = await fanout(sub_msgs, send, workers=FANOUT_WORKERS)
+    for sub_chat, result in results.items():
+        if isinstance(result, BadRequest):
+            print(f"Couldn't delete message {sub_msgs[sub_chat]} in {sub_chat}: {result}")
+        elif isinstance(result, Exception):
+            print(f"Unexpected error deleting message: {result}")
+
+    if cold:
+        MyBotState.cold_forward_keys.discard(BotState.state_key(key))
+        await asyncio.to_thread(BotState.drop_cold_forward, key)
+    else:
+        MyBotState.forward_map.pop(key, None)
 
 async def handle_gambling(update: Update, context: ContextTypes.DEFAULT_TYPE):
     print("handle_gambling")
@@ -462,12 +562,26 @@ async def on_chat_member(update, context):
 
     old = update.chat_member.old_chat_member
     new = update.chat_member.new_chat_member
+    remember_user(new.user)
+    remember_chat(update.chat_member.chat)
 
     left = old.status in ("member","administrator","creator") and new.status in ("left","kicked")
     joined = old.status in ("left","kicked") and new.status in ("member","administrator","creator")
 
+    status = new.status
+    if status == "restricted" and not new.is_member:
+        status = "left"
+    if status in LEFT_STATUSES:
+        joined_at = None
+    elif joined:
+        joined_at = update.chat_member.date.timestamp()
+    else:
+        joined_at = (MyBotState.chat_members.get(new.user.id) or {}).get("joined")
+    set_chat_member(new.user.id, status, joined_at)
+
     if joined:
         print(f"User {new.user.id} joined the chat")
+        record_first_join(new.user.id, joined_at)
     elif left:
         print(f"User {new.user.id} left the chat")
 
@@ -1,8 +1,10 @@
 import math
-import unicodedata
+import time
 
 from .updates import *
 from .config import MyBotState
+from .persistence import stop_state_flusher
+from .reaction_queue import ReactionQueue
 
 from datetime import timezone
 
@@ -30,36 +32,69 @@ async def on_message_reaction(mc, event):
     if chat_id != ORIG_CHANNEL_ID:
         return
 
-    msg_id = event.msg_id
+    reactor_id = get_peer_id(event.actor) if hasattr(event, "actor") else None
+
+    old = getattr(event, 'old_reactions', []) or []
+    new = getattr(event, 'new_reactions', []) or getattr(event, 'new_reaction', [])
+
+    reaction_queue.push((chat_id, event.msg_id, reactor_id), old, new)
+
+async def process_reactions(batch):
+    # messages missing from the cache are fetched in one call
+    messages = {(chat_id, msg_id) for (chat_id, msg_id, _), _, _ in batch}
+    await asyncio.gather(
+        *(get_message_meta(chat_id, msg_id) for chat_id, msg_id in messages),
+        return_exceptions=True
+    )
+
+    coins = {}
+    for (chat_id, msg_id, reactor_id), old, new in batch:
+        try:
+            await count_reaction(chat_id, msg_id, reactor_id, old, new, coins)
+        except Exception as e:
+            print(f"Failed to count reaction on {msg_id} by {reactor_id}: {e}")
+
+    try:
+        apply_coins(coins)
+    except Exception as e:
+        # the rating events are already recorded, so the coins go in one by one
+        print(f"Failed to update coins for {len(batch)} reactions, retrying per user: {e}")
+        for uid, amount in coins.items():
+            if not amount:
+                continue
+            try:
+                update_coins(uid, amount)
+            except Exception as e:
+                print(f"Lost {amount} coins of {uid} for reactions: {e}")
+    print(f"Processed {len(batch)} reactions")
+
+async def flush_on_shutdown(app):
+    # reactions still waiting to be merged are counted before the last flush
+    await reaction_queue.flush()
+    await stop_state_flusher(app)
+
+async def count_reaction(chat_id, msg_id, reactor_id, old, new, coins: dict):
+    """Counts one (merged) reaction change, adding the author's coins to `coins`."""
+    msg = await get_message_meta(chat_id, msg_id)
 
-    msg = await mc.get_messages(chat_id, ids=msg_id)
-    
     if not msg:
         return
-    
-    print("orig_msg: ", msg)
 
-    old = getattr(event, 'old_reactions', []) or []
-    new = getattr(event, 'new_reactions', []) or getattr(event, 'new_reaction', [])
+    print("orig_msg: ", msg)
 
-    old_set = set(extract_emojis(old))
-    new_set = set(extract_emojis(new))
-    
-    added   = new_set - old_set
-    removed = old_set - new_set
+    delta, old_set, new_set = reaction_delta(old, new)
 
-    print(f"added reactions: {added}")
-    print(f"removed reactions: {removed}")
+    print(f"reactions: {old_set} -> {new_set}, delta: {delta}")
 
     now = datetime.now(TYUMEN)
-    msg_ts = msg.date.timestamp() 
+    msg_ts = msg["date"]
     print("debug now ts: ", now.timestamp())
     print("debug msg ts: ", msg_ts)
     if now.timestamp() - msg_ts > 600:
         print("message is too old, we ignore")
     else:
         #check if it via howyour bot and add to database if it's more then 3 reactions
-        if len(old_set) == 0 and len(new_set) >= 1 and msg.via_bot_id is not None:
+        if len(old_set) == 0 and len(new_set) >= 1 and msg["via_bot_id"] is not None:
             print("enough reactions via bot")
             db.execute(
                 "INSERT OR IGNORE INTO white_msg (msg_id, ts) VALUES (?, ?)",
@@ -67,18 +102,10 @@ async def on_message_reaction(mc, event):
             )
             db.commit()
 
-    author_id = None
-    if hasattr(msg, "from_id"):
-        if msg.from_id != None:
-            author_id = get_peer_id(msg.from_id)
-        else:
-            author_id = TARGET_USER
-    else:
-        return
+    author_id = msg["author_id"]
 
-    if not hasattr(event, "actor"):
+    if reactor_id is None:
         return
-    reactor_id = get_peer_id(event.actor)
 
     if reactor_id == author_id:
         return
@@ -86,12 +113,13 @@ async def on_message_reaction(mc, event):
     print("author_id: ", author_id)
     print("reactor_id: ", reactor_id)
     
-    if reactor_id != ORIG_CHANNEL_ID and count_total_rating(MyBotState.social_rating, reactor_id) < -100:
+    if reactor_id != ORIG_CHANNEL_ID and MyBotState.rating_totals.total(reactor_id) < -100:
         print("too low social rating")
         return
 
     if reactor_id != ORIG_CHANNEL_ID and reactor_id != TARGET_USER:
-        join_date = await get_join_date(ORIG_CHANNEL_ID, reactor_id)
+        membership = await get_chat_membership(reactor_id)
+        join_date = to_dt(membership["joined"]) if is_chat_member(membership) else None
         if not join_date:
             print("user not in the chat to count rating")
             return
@@ -99,12 +127,6 @@ async def on_message_reaction(mc, event):
             print("member is too new")
             return
 
-    delta = 0
-    for e in added:
-        delta += get_emoji_weight(e)
-    for e in removed:
-        delta -= get_emoji_weight(e)
-        
     if delta == 0:
         print("delta is zero, we quit")
         if reactor_id in (TARGET_USER, ORIG_CHANNEL_ID):
@@ -112,36 +134,14 @@ async def on_message_reaction(mc, event):
 
         return
 
-    entry = MyBotState.social_rating.setdefault(author_id, {
-        "reactor_counts": {},
-        "total_reacts":    0,
-        "additional_chat": 0,
-        "additional_neri": 0,
-        "additional_self": 0,
-        "boosts":          0,
-        "manual_rating":   0,
-        "reactor_dates":   [],
-    })
-
     if reactor_id not in (TARGET_USER, ORIG_CHANNEL_ID) and author_id != TARGET_USER:
-        rc = entry["reactor_counts"]
-        reactor_spec_data = rc.setdefault(
-            reactor_id,
-            {"count": 0, "value": 0, "reactor_dates": []}
-        )
-
-        reactor_data = MyBotState.social_rating.setdefault(reactor_id, {
-            "reactor_counts": {},
-            "total_reacts":    0,
-            "additional_chat": 0,
-            "additional_neri": 0,
-            "additional_self": 0,
-            "boosts":          0,
-            "manual_rating":   0,
-            "reactor_dates":   [],
-        })
-
-        prev_count  = reactor_spec_data["count"]
+        entry = MyBotState.social_rating.get(author_id, {})
+        rc = entry.get("reactor_counts", {})
+
+        if reactor_id not in MyBotState.social_rating:
+            MyBotState.record_rating_event("create", reactor_id)
+
+        prev_count  = rc.get(reactor_id, {}).get("count", 0)
         total_count = sum(d["count"] for d in rc.values())
 
         if total_count >= 50:
@@ -150,40 +150,15 @@ async def on_message_reaction(mc, event):
                 print("Too many reacts counted!")
                 return
 
-        now = datetime.utcnow()
-        raw_dates = reactor_data.get("reactor_dates", [])
-        parsed = []
-        for ts in raw_dates:
-            if isinstance(ts, str):
-                try:
-                    parsed.append(datetime.fromisoformat(ts))
-                except ValueError:
-                    continue
-            elif isinstance(ts, datetime):
-                parsed.append(ts)
-        parsed.sort(reverse=True)
-
-        # 3rd most recent must be ≥1 min ago
-        if len(parsed) >= 3 and (now - parsed[2]) < timedelta(seconds=30):
-            print("Too many reacts counted too quickly (3-reaction/minute limit)")
-            return
-
-        # 5th most recent must be ≥10 min ago
-        if len(parsed) >= 10 and (now - parsed[4]) < timedelta(minutes=5):
-            print("Too many reacts counted too quickly (5-reaction/10 min limit)")
-            return
-
-        # 10th most recent must be ≥1 h ago
-        if len(parsed) >= 30 and (now - parsed[9]) < timedelta(minutes=30):
-            print("Too many reacts counted too quickly (10-reaction/hour limit)")
+        ts = time.time()
+        limit = MyBotState.reaction_limiter.check(reactor_id, ts)
+        if limit:
+            count, seconds, _ = limit
+            print(f"Too many reacts counted too quickly ({count} reactions/{seconds}s limit)")
             return
 
-        parsed.insert(0, now)
-        parsed = parsed[:60]
-        reactor_data["reactor_dates"] = [dt.isoformat() for dt in parsed]
-
-        reactor_spec_data["count"] += 1
-        entry["total_reacts"] = total_count + 1
+        MyBotState.reaction_limiter.record(reactor_id, ts)
+        MyBotState.mark_dirty("reaction_limits", reactor_id)
 
     print("delta:", delta)
     if delta == 0:
@@ -191,57 +166,40 @@ async def on_message_reaction(mc, event):
 
     multiplier = 1
     if reactor_id == TARGET_USER or reactor_id == ORIG_CHANNEL_ID:
-        entry["additional_neri"] = entry["additional_neri"] + delta
+        MyBotState.record_rating_event("neri", author_id, reactor_id, delta)
         multiplier = 15
     elif author_id == TARGET_USER:
-        entry["additional_self"] = entry["additional_self"] + delta
+        MyBotState.record_rating_event("self", author_id, reactor_id, delta)
     else:
-        reactor_data = entry["reactor_counts"].setdefault(
-            reactor_id, {"count": 0, "value": 0}
-        )
-        reactor_data["value"] += delta
+        MyBotState.record_rating_event("react", author_id, reactor_id, delta)
         
-    update_coins(author_id, multiplier * delta)
-    MyBotState.save_social_rating()
+    coins[author_id] = coins.get(author_id, 0) + multiplier * delta
 
     print(
         f"[Reactions] msg#{msg_id} for user {author_id} by user {reactor_id}: "
-        f"+{len(added)} added, -{len(removed)} removed → delta={delta}"
+        f"+{len(new_set - old_set)} added, -{len(old_set - new_set)} removed → delta={delta}"
     )
 
-def extract_emojis(lst):
-    out = []
-    for r in lst:
-        if isinstance(r, ReactionEmoji):
-            out.append(r.emoticon)
-        elif isinstance(r, ReactionCustomEmoji):
-            out.append(f"<custom:{r.document_id}>")
-    return out
-
-def get_emoji_weight(e: str) -> int:
-    """
-    Look up e in emoji_weights, trying to normalize both
-    with and without the VARIATION SELECTOR-16 (U+FE0F).
-    """
-    # First try exactly as‐is
-    if e in MyBotState.emoji_weights:
-        return MyBotState.emoji_weights[e]
-
-    # Normalize to NFC (just in case)
-    e_nfc = unicodedata.normalize("NFC", e)
-    if e_nfc != e and e_nfc in MyBotState.emoji_weights:
-        return MyBotState.emoji_weights[e_nfc]
-
-    # Try adding VS16 if it’s missing
-    VS16 = "\uFE0F"
-    if not e_nfc.endswith(VS16):
-        cand = e_nfc + VS16
-        if cand in MyBotState.emoji_weights:
-            return MyBotState.emoji_weights[cand]
-    else:
-        # Or stripping it
-        cand = e_nfc.rstrip(VS16)
-        if cand in MyBotState.emoji_weights:
-            return MyBotState.emoji_weights[cand]
+def reaction_key(r):
+    # the key of the reaction in MyBotState.emoji_table
+    if isinstance(r, ReactionEmoji):
+        return r.emoticon
+    if isinstance(r, ReactionCustomEmoji):
+        return r.document_id
+    return None
+
+def reaction_delta(old, new):
+    """(weight of the change, reactions before, reactions after)"""
+    before = {reaction_key(r) for r in old}
+    after = {reaction_key(r) for r in new}
+    before.discard(None)
+    after.discard(None)
+
+    delta = 0
+    table = MyBotState.emoji_table
+    for key in before ^ after:
+        weight = table_weight(table, key)
+        delta += weight if key in after else -weight
+    return delta, before, after
 
-    return 0
\ No newline at end of file
+reaction_queue = ReactionQueue(process_reactions, REACTION_COALESCE_DELAY, REACTION_BATCH_SIZE)
@@ -0,0 +1,131 @@
+import json
+import sqlite3
+import threading
+
+from datetime import datetime
+
+
+class StateStore:
+    """
+    Keeps each in-memory collection of BotState as a key/value table,
+    so a change to one user or one message only rewrites its own row.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS state_migration (
+                    name TEXT PRIMARY KEY,
+                    ts   INTEGER NOT NULL
+                )
+            """)
+        self.collections = set()
+
+    def ensure_collection(self, name: str):
+        if name in self.collections:
+            return
+        with self.lock, self.conn:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS state_{name} (
+                    key   TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+        self.collections.add(name)
+
+    def load(self, name: str) -> dict:
+        self.ensure_collection(name)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT key, value FROM state_{name} ORDER BY rowid"
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def keys(self, name: str) -> set:
+        self.ensure_collection(name)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT key FROM state_{name}").fetchall()
+        return {key for key, in rows}
+
+    def get(self, name: str, key: str):
+        self.ensure_collection(name)
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT value FROM state_{name} WHERE key = ?",
+                (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # upsert_rows/delete_rows/clear_rows expect the caller to hold the lock
+    # and run inside a transaction, so several tables can change atomically
+
+    def upsert_rows(self, name: str, items: dict):
+        self.conn.executemany(
+            f"INSERT INTO state_{name} (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            [
+                (str(k), json.dumps(v, ensure_ascii=False))
+                for k, v in items.items()
+            ]
+        )
+
+    def delete_rows(self, name: str, keys):
+        self.conn.executemany(
+            f"DELETE FROM state_{name} WHERE key = ?",
+            [(str(k),) for k in keys]
+        )
+
+    def clear_rows(self, name: str):
+        self.conn.execute(f"DELETE FROM state_{name}")
+
+    def write(self, name: str, upserts: dict, deletes=()):
+        self.ensure_collection(name)
+        with self.lock, self.conn:
+            if upserts:
+                self.upsert_rows(name, upserts)
+            if deletes:
+                self.delete_rows(name, deletes)
+
+    def replace(self, name: str, items: dict):
+        self.ensure_collection(name)
+        with self.lock, self.conn:
+            self.clear_rows(name)
+            self.upsert_rows(name, items)
+
+    def is_migrated(self, name: str) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM state_migration WHERE name = ?",
+                (name,)
+            ).fetchone()
+        return row is not None
+
+    def migrate_json(self, name: str, path, convert=None):
+        """
+        Imports a legacy JSON file into the collection once. The file itself
+        is left in place as a backup.
+        """
+        if self.is_migrated(name):
+            return
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = None
+
+        items = {}
+        if data is not None:
+            items = convert(data) if convert else data
+
+        self.replace(name, items)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO state_migration (name, ts) VALUES (?, ?)",
+                (name, int(datetime.now().timestamp()))
+            )
+        print(f"Migrated {len(items)} {name} rows from {path}")
@@ -6,81 +6,36 @@ from .utils import *
 from telegram import (
     Update,
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     ContextTypes,
 )
 
 async def build_stats_page_async(mode: str, page: int, bot) -> tuple[str, InlineKeyboardMarkup]:
-    # выбираем, откуда брать данные и как подписать режим
-    if mode == "global":
-        items   = list(MyBotState.message_stats.items())
-        mode_ru = "глобально по сообщениям"
-
-    elif mode == "daily":
-        items   = list(MyBotState.daily_stats.items())
-        mode_ru = "сегодня"
-
-    elif mode == "cock":
-        items   = [(uid, info["size"]) for uid, info in MyBotState.last_sizes.items()]
-        mode_ru = "по размеру"
-
-    elif mode == "social":
-        items = []
-        for uid, info in MyBotState.social_rating.items():
-            if uid == TARGET_USER:
-                continue
-            total = count_total_rating(MyBotState.social_rating, uid)
-            neri  = count_neri_rating(MyBotState.social_rating, uid)
-            items.append((uid, total, neri))
-        mode_ru = "соц. рейтинг (текущий)"
-
-    elif mode == "social_global":
-        items = []
-        for uid, info in MyBotState.old_social_rating.items():
-            if uid == TARGET_USER:
-                continue
-            total = count_total_rating(MyBotState.old_social_rating, uid) + count_total_rating(MyBotState.social_rating, uid)
-            neri  = count_neri_rating(MyBotState.old_social_rating, uid) + count_neri_rating(MyBotState.social_rating, uid)
-            items.append((uid, total, neri))
-        mode_ru = "соц. рейтинг (глобальный)"
-
-    elif mode == "casino":
-        # Загружаем монетки из БД: таблица users (или замените на вашу)
-        with db:
-            rows = db.execute(
-                "SELECT id, coins FROM user"
-            ).fetchall()
-        items   = [(r["id"], r["coins"]) for r in rows]
-        mode_ru = "по рыженке"
-
-    else:
-        items   = []
-        mode_ru = mode
-
-    # сортируем, разбиваем на страницы
-    sorted_stats = sorted(items, key=lambda kv: kv[1], reverse=True)
-    total        = len(sorted_stats)
+    modes_ru = {
+        "global":        "глобально по сообщениям",
+        "daily":         "сегодня",
+        "cock":          "по размеру",
+        "social":        "соц. рейтинг (текущий)",
+        "social_global": "соц. рейтинг (глобальный)",
+        "casino":        "по рыженке",
+    }
+    mode_ru = modes_ru.get(mode, mode)
+
+    # доски отсортированы заранее, страница — это срез
+    board = MyBotState.leaderboard(mode)
+    total        = len(board) if board is not None else 0
     start, end   = page * PAGE_SIZE, (page + 1) * PAGE_SIZE
     last_page    = max((total - 1) // PAGE_SIZE, 0)
-    chunk        = sorted_stats[start:end]
+    chunk        = board.page(start, end) if board is not None else []
 
     # формируем текст
     header = f"📊 Топ ({mode_ru.capitalize()}) #{start+1}–{min(end, total)} из {total}:\n"
     lines = [header]
-    for rank, entry in enumerate(chunk, start=start+1):
-        # social-режимы имеют тройку (uid, total, neri)
-        if mode.startswith("social"):
-            uid, full, neri = entry
-        else:
-            uid, full = entry
-            neri = None
-
-        # пытаемся получить имя пользователя
-        try:
-            uc   = await bot.get_chat(uid)
-            name = parse_name(uc)
-        except:
-            name = escape(str(uid))
+    profiles = await resolve_profiles(bot, [uid for uid, _, _ in chunk])
+    for rank, (uid, full, neri) in enumerate(chunk, start=start+1):
+        uc   = profiles.get(uid)
+        name = parse_name(uc) if uc else escape(str(uid))
 
         # формируем строку в зависимости от режима
         if mode == "cock":
@@ -130,6 +85,22 @@ async def build_stats_page_async(mode: str, page: int, bot) -> tuple[str, Inline
     kb = InlineKeyboardMarkup([mode1_buttons, mode2_buttons, nav_buttons])
     return text, kb
 
+async def get_stats_page(mode: str, page: int, bot) -> tuple[str, InlineKeyboardMarkup]:
+    # a rendered page stays valid while its board has the same version
+    board = MyBotState.leaderboard(mode)
+    version = board.version if board is not None else None
+
+    cached = MyBotState.stats_pages.get((mode, page))
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    text, kb = await build_stats_page_async(mode, page, bot)
+    MyBotState.stats_pages.set((mode, page), (version, text, kb))
+    return text, kb
+
+def remember_stats_page(chat_id: int, message_id: int, text: str, kb: InlineKeyboardMarkup):
+    MyBotState.shown_stats_pages.set((chat_id, message_id), (text, kb))
+
 async def stats_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -141,8 +112,19 @@ async def stats_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     _, mode, page_str = q.data.split(":")
     page = int(page_str)
-    text, kb = await build_stats_page_async(mode, page, context.bot)
-    await q.edit_message_text(text=text, parse_mode="HTML", reply_markup=kb)
+    text, kb = await get_stats_page(mode, page, context.bot)
+
+    # nothing to edit if the message already shows this page
+    key = (msg.chat_id, msg.message_id)
+    if MyBotState.shown_stats_pages.get(key) == (text, kb):
+        return
+
+    try:
+        await q.edit_message_text(text=text, parse_mode="HTML", reply_markup=kb)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    remember_stats_page(msg.chat_id, msg.message_id, text, kb)
 
 async def follow_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
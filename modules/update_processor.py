@@ -0,0 +1,71 @@
+import asyncio
+
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_keys(update: Update) -> list:
+    """
+    What an update touches: its user, the user it replies to (/transfer,
+    /sc), a user whose membership changed, and the message it is about.
+    """
+    keys = set()
+
+    if update.effective_user:
+        keys.add(("user", update.effective_user.id))
+
+    member = update.chat_member or update.my_chat_member
+    if member:
+        keys.add(("user", member.new_chat_member.user.id))
+
+    msg = update.effective_message
+    if msg:
+        keys.add(("message", msg.chat_id, msg.message_id))
+        reply = msg.reply_to_message
+        if reply and reply.from_user:
+            keys.add(("user", reply.from_user.id))
+
+    # a fixed order, so two updates never wait for each other's locks
+    return sorted(keys)
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Runs updates concurrently, but updates with a key in common (the same
+    user or the same message) one after another, in the order they came.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self.locks = {}
+
+    @asynccontextmanager
+    async def locked(self, key):
+        slot = self.locks.setdefault(key, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self.locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        if not isinstance(update, Update):
+            await coroutine
+            return
+
+        async with AsyncExitStack() as stack:
+            for key in update_keys(update):
+                await stack.enter_async_context(self.locked(key))
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -6,7 +6,6 @@ from telegram.ext import (
 )
 
 async def persist_stats(context: ContextTypes.DEFAULT_TYPE):
-    MyBotState.save_stats()
     MyBotState.save_daily_stats()
     clear_and_save_cocks()
     clear_old_messages()
@@ -16,26 +15,59 @@ def check_init_user_table():
     row = db.execute("SELECT COUNT(*) AS cnt FROM user").fetchone()
     if row["cnt"] == 0:
         for uid, info in MyBotState.social_rating.items():
-            total = count_total_rating(MyBotState.social_rating, uid)
+            total = MyBotState.rating_totals.total(uid)
             db.execute(
                 "INSERT INTO user (id, coins) VALUES (?, ?)",
                 (uid, total)
             )
 
+ADD_COINS_SQL = (
+    "INSERT INTO user (id, coins) VALUES (?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET coins = COALESCE(coins, 0) + excluded.coins "
+    "RETURNING coins"
+)
+
 def update_coins(uid, coins):
+    # a single statement, so concurrent handlers can't lose each other's change
+    with db:
+        new_balance = db.execute(ADD_COINS_SQL, (uid, coins)).fetchone()["coins"]
+    print(f"Updating coins for {uid}: {new_balance - coins} → {new_balance}; change: {coins}")
+    MyBotState.leaderboards["casino"].set(uid, new_balance)
+    return new_balance
+
+def apply_coins(changes: dict):
+    """update_coins for {uid: coins} in one transaction."""
+    changes = {uid: coins for uid, coins in changes.items() if coins}
+    if not changes:
+        return
+
+    with db:
+        balances = {
+            uid: db.execute(ADD_COINS_SQL, (uid, coins)).fetchone()["coins"]
+            for uid, coins in changes.items()
+        }
+    for uid, new_balance in balances.items():
+        MyBotState.leaderboards["casino"].set(uid, new_balance)
+    print(f"Updated coins of {len(balances)} users: {changes}")
+
+def spend_coins(uid, coins):
+    """Takes coins from uid if they have enough. Returns the new balance, or None."""
+    if coins == 0:
+        return update_coins(uid, 0)
     with db:
         row = db.execute(
-            "SELECT coins FROM user WHERE id = ?",
-            (uid,)
+            "UPDATE user SET coins = COALESCE(coins, 0) - ? "
+            "WHERE id = ? AND COALESCE(coins, 0) >= ? "
+            "RETURNING coins",
+            (coins, uid, coins)
         ).fetchone()
-        current = row["coins"] if row else 0
-        new_balance = current + coins
-        print(f"Updating coins for {uid}: {current} → {new_balance}; change: {coins}")
-        db.execute(
-            "INSERT INTO user (id, coins) VALUES (?, ?) "
-            "ON CONFLICT(id) DO UPDATE SET coins = excluded.coins",
-            (uid, new_balance)
-        )
+    if row is None:
+        return None
+
+    new_balance = row["coins"]
+    print(f"Updating coins for {uid}: {new_balance + coins} → {new_balance}; change: {-coins}")
+    MyBotState.leaderboards["casino"].set(uid, new_balance)
+    return new_balance
 
 async def reset_daily(context: ContextTypes.DEFAULT_TYPE):
     yesterday = (datetime.now(TYUMEN) - timedelta(days=1)).date()
@@ -43,6 +75,7 @@ async def reset_daily(context: ContextTypes.DEFAULT_TYPE):
     if MyBotState.daily_stats:
         ypath.write_text(json.dumps(MyBotState.daily_stats, ensure_ascii=False, indent=2))
     MyBotState.daily_stats.clear()
+    MyBotState.leaderboards["daily"].clear()
     MyBotState.save_daily_stats()
     print(f"Rotated daily stats: {yesterday} → {ypath.name}")
 
@@ -66,7 +99,9 @@ def clear_and_save_cocks():
 
     for key in to_delete:
         del MyBotState.last_sizes[key]
-    MyBotState.save_last_sizes()
+    if to_delete:
+        MyBotState.mark_dirty("last_sizes", *to_delete)
+        MyBotState.refresh_leaderboard("cock", *to_delete)
 
 async def reset_monthly_social_rating(context: ContextTypes.DEFAULT_TYPE):
     now = datetime.now(TYUMEN)
@@ -94,7 +129,6 @@ async def reset_monthly_social_rating(context: ContextTypes.DEFAULT_TYPE):
             "additional_self":  info.get("additional_self", 0),
             "boosts":           info.get("boosts", 0),
             "manual_rating":    info.get("manual_rating", 0),
-            "reactor_dates":    info.get("reactor_dates", []),
         }
         for uid, info in MyBotState.social_rating.items()
     }
@@ -102,8 +136,8 @@ async def reset_monthly_social_rating(context: ContextTypes.DEFAULT_TYPE):
     with open(archive_file, "w", encoding="utf-8") as f:
         json.dump(dump, f, ensure_ascii=False, indent=2)
 
-    MyBotState.social_rating.clear()
-    MyBotState.save_social_rating()
+    MyBotState.record_rating_event("reset")
     MyBotState.load_old_social_rating()
+    MyBotState.rebuild_leaderboards("social_global")
 
     print(f"[Monthly reset] Archived to {archive_file} and cleared current social_rating.")
\ No newline at end of file
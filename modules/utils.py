@@ -1,11 +1,22 @@
 import asyncio
 import hashlib
+import httpx
 import random
 
 from .bot_state import *
 from .config import MyBotState
+from .image_hash import image_hashes
 
+from telethon.errors import UserNotParticipantError
 from telethon.tl.functions.channels import GetParticipantRequest
+from telethon.utils import get_peer_id
+from telethon.tl.types import (
+    ChannelParticipantAdmin,
+    ChannelParticipantBanned,
+    ChannelParticipantCreator,
+    ChannelParticipantLeft,
+    MessageEmpty,
+)
 from typing import Callable, Awaitable
 
 from html import escape
@@ -29,6 +40,12 @@ def to_dt(value):
     return None
 
 async def get_join_date(chat_id: int, user_id: int):
+    if chat_id == ORIG_CHANNEL_ID:
+        membership = await get_chat_membership(user_id)
+        if not is_chat_member(membership):
+            return None
+        return to_dt(membership["joined"])
+
     try:
         res = await MyBotState.mc(GetParticipantRequest(
             channel=chat_id,
@@ -41,10 +58,173 @@ async def get_join_date(chat_id: int, user_id: int):
         print("exception in get_join_date: ", e)
         return None
 
+def participant_status(part) -> str:
+    # telethon participant -> bot API style status
+    if isinstance(part, ChannelParticipantCreator):
+        return "creator"
+    if isinstance(part, ChannelParticipantAdmin):
+        return "administrator"
+    if isinstance(part, ChannelParticipantLeft):
+        return "left"
+    if isinstance(part, ChannelParticipantBanned):
+        if part.left:
+            return "left"
+        return "kicked" if part.banned_rights.view_messages else "restricted"
+    return "member"
+
+def participant_joined(part):
+    date = getattr(part, "date", None)
+    return date.timestamp() if date else None
+
+def set_chat_member(uid: int, status: str, joined=None):
+    """Records membership of uid in ORIG_CHANNEL_ID, joined is a unix timestamp."""
+    entry = {"status": status, "joined": joined}
+    if MyBotState.chat_members.get(uid) != entry:
+        MyBotState.chat_members[uid] = entry
+        MyBotState.mark_dirty("chat_members", uid)
+
+def first_join_if_never_left(uid: int):
+    # user.chat_joined is the first join, it is the current one only for
+    # users we never saw leave
+    row = db.execute(
+        "SELECT chat_joined, left_cnt FROM user WHERE id = ?",
+        (uid,)
+    ).fetchone()
+    if row is None or not row["chat_joined"] or row["left_cnt"]:
+        return None
+    return row["chat_joined"]
+
+def record_first_join(uid: int, joined):
+    with db:
+        db.execute(
+            "UPDATE user SET chat_joined = COALESCE(chat_joined, ?) WHERE id = ?",
+            (int(joined), uid)
+        )
+
+async def get_chat_membership(uid: int):
+    """
+    Membership entry of uid in ORIG_CHANNEL_ID. The table is kept current
+    from member updates, only unknown users and members whose join date
+    we don't know are asked from the API. Returns None if that fails.
+    """
+    entry = MyBotState.chat_members.get(uid)
+    if entry is not None:
+        if entry["joined"] or not is_chat_member(entry):
+            return entry
+
+        joined = first_join_if_never_left(uid)
+        if joined:
+            set_chat_member(uid, entry["status"], joined)
+            return MyBotState.chat_members[uid]
+
+    try:
+        res = await MyBotState.mc(GetParticipantRequest(
+            channel=ORIG_CHANNEL_ID,
+            participant=uid
+        ))
+        status = participant_status(res.participant)
+        joined = participant_joined(res.participant)
+    except UserNotParticipantError:
+        status, joined = "left", None
+    except Exception as e:
+        print(f"exception in get_chat_membership for {uid}: {e}")
+        return None
+
+    set_chat_member(uid, status, joined)
+    return MyBotState.chat_members[uid]
+
+def is_chat_member(entry) -> bool:
+    return entry is not None and entry["status"] not in LEFT_STATUSES
+
+async def seed_chat_members(context=None):
+    seen = {}
+    try:
+        participants = MyBotState.mc.iter_participants(ORIG_CHANNEL_ID)
+        async for user in participants:
+            part = user.participant
+            seen[user.id] = (participant_status(part), participant_joined(part))
+    except Exception as e:
+        print(f"exception in seed_chat_members: {e}")
+        return
+
+    for uid, (status, joined) in seen.items():
+        set_chat_member(uid, status, joined)
+
+    # big chats are listed only partially, then we can't tell who is gone
+    if len(seen) >= (participants.total or 0):
+        for uid, entry in list(MyBotState.chat_members.items()):
+            if uid not in seen and is_chat_member(entry):
+                set_chat_member(uid, "left")
+
+    print(f"Seeded {len(seen)} of {participants.total} chat members")
+
 async def compute_sha256(bot, file_id):
-    bio = await bot.get_file(file_id)
-    data = await bio.download_as_bytearray()
-    return hashlib.sha256(data).hexdigest()
+    # streamed in chunks, hashlib releases the GIL so hashing runs in a thread
+    file = await bot.get_file(file_id)
+    hasher = hashlib.sha256()
+
+    if file.file_path.startswith(("http://", "https://")):
+        async with httpx.AsyncClient(timeout=60) as client:
+            async with client.stream("GET", file.file_path) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.aiter_bytes(HASH_CHUNK_SIZE):
+                    await asyncio.to_thread(hasher.update, chunk)
+    else:
+        # local bot API server gives a path on disk
+        def hash_local():
+            with open(file.file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+        await asyncio.to_thread(hash_local)
+
+    return hasher.hexdigest()
+
+async def media_sha256(bot, file_id, file_unique_id):
+    """
+    SHA-256 of a file, cached by file_unique_id in memory and in the state
+    database, so a file is downloaded at most once.
+    """
+    if not file_unique_id:
+        return await compute_sha256(bot, file_id)
+
+    digest = MyBotState.media_hashes.get(file_unique_id)
+    if digest:
+        return digest
+
+    row = store.get("media_hashes", file_unique_id)
+    if row:
+        digest = row["sha256"]
+    else:
+        digest = await compute_sha256(bot, file_id)
+        await asyncio.to_thread(store.write, "media_hashes", {file_unique_id: {"sha256": digest}})
+
+    MyBotState.media_hashes.set(file_unique_id, digest)
+    return digest
+
+async def media_image_hashes(bot, sig: dict):
+    """
+    Perceptual hashes of the media's still image, cached by file_unique_id.
+    None if it has no image or the image can't be decoded.
+    """
+    file_id = sig.get("_image_file_id")
+    if not file_id:
+        return None
+
+    key = sig.get("file_unique_id")
+    found, hashes = MyBotState.image_hashes.lookup(key)
+    if found:
+        return hashes
+
+    file = await bot.get_file(file_id)
+    data = await file.download_as_bytearray()
+    try:
+        hashes = await asyncio.to_thread(image_hashes, bytes(data))
+    except Exception as e:
+        print(f"Couldn't hash image of {key}: {e}")
+        hashes = None
+
+    MyBotState.image_hashes.set(key, hashes)
+    return hashes
 
 def parse_name(uc):
     if uc.id == TARGET_USER:
@@ -56,6 +236,46 @@ def parse_name(uc):
         return escape(f"@{uc.username}")
     return escape(str(uc.id))
 
+def remember_user(user):
+    # anything with first_name/last_name/username works with parse_name
+    if user is not None:
+        MyBotState.profiles.set(user.id, user)
+
+async def resolve_profiles(bot, uids, rate_limit_args=None) -> dict:
+    """
+    Returns {uid: user or None} from the profile cache, asking get_chat
+    only for misses, a few at a time. Failed lookups are cached too. Jobs
+    pass rate_limit_args=BACKGROUND.
+    """
+    result = {}
+    misses = []
+    for uid in uids:
+        found, profile = MyBotState.profiles.lookup(uid)
+        if found:
+            result[uid] = profile
+        else:
+            misses.append(uid)
+
+    if not misses:
+        return result
+
+    sem = asyncio.Semaphore(PROFILE_FETCH_CONCURRENCY)
+
+    async def fetch(uid):
+        async with sem:
+            try:
+                chat = await bot.get_chat(uid, rate_limit_args=rate_limit_args)
+            except Exception as e:
+                print(f"exception in resolve_profiles for {uid}: {e}")
+                MyBotState.profiles.set(uid, None, PROFILE_MISS_TTL.total_seconds())
+                return uid, None
+        remember_user(chat)
+        return uid, chat
+
+    for uid, profile in await asyncio.gather(*(fetch(uid) for uid in misses)):
+        result[uid] = profile
+    return result
+
 def parse_alias_name(uc):
     indexed_user = MyBotState.indexed_users.get(uc.id)
     if indexed_user is not None:
@@ -90,32 +310,6 @@ async def alias_for_uid(bot, uid):
         print("exception in alias_for_uid")
         return "Неизвестный герой"
 
-def count_total_rating(sr, uid):
-    if uid not in sr:
-        return 0
-    info = sr[uid]
-
-    total = (
-        info.get("additional_chat", 0)
-        + info.get("additional_neri", 0) * 15
-        + info.get("boosts", 0) * 5
-        + info.get("manual_rating", 0)
-    )
-
-    total += sum(
-        entry.get("value", 0)
-        for reactor_id, entry in info.get("reactor_counts", {}).items()
-        if not sr.get(reactor_id, {}).get("banned", False)
-    )
-
-    return total
-
-def count_neri_rating(sr, uid):
-    if uid not in sr:
-        return 0
-    info = sr[uid]
-    return info.get("additional_neri", 0) * 15 + info.get("boosts", 0) * 5 + info.get("manual_rating", 0)
-
 def format_duration(delta: timedelta) -> str:
     total = int(delta.total_seconds())
     hrs, rem = divmod(total, 3600)
@@ -126,14 +320,121 @@ def format_duration(delta: timedelta) -> str:
     if secs or not parts: parts.append(f"{secs} сек")
     return " ".join(parts)
 
-async def make_link_keyboard(orig_chat_id, orig_msg_id, bot):
-    chat = await bot.get_chat(orig_chat_id)
-    if chat.username:
-        link = f"https://t.me/{chat.username}/{orig_msg_id}"
+def build_message_link(username, chat_id: int, msg_id: int) -> str:
+    if username:
+        return f"https://t.me/{username}/{msg_id}"
+    cid = str(chat_id)
+    return f"https://t.me/c/{cid[4:]}/{msg_id}"
+
+def remember_chat(chat):
+    # updates carry the chat, so a renamed chat replaces the cached entry
+    if chat is None:
+        return
+    found, username = MyBotState.chat_meta.lookup(chat.id)
+    if not found or username != chat.username:
+        MyBotState.chat_meta.set(chat.id, chat.username)
+
+async def get_chat_username(chat_id: int, bot):
+    found, username = MyBotState.chat_meta.lookup(chat_id)
+    if found:
+        return username
+
+    chat = await bot.get_chat(chat_id)
+    remember_chat(chat)
+    return chat.username
+
+# what the reaction handler needs to know about a message:
+# {"author_id", "date" (timestamp), "via_bot_id"}, None if there is no message
+
+def bot_message_meta(msg) -> dict:
+    # sender_chat is set for anonymous admins and channel posts, the same
+    # peer Telethon has in from_id
+    if msg.sender_chat:
+        author_id = msg.sender_chat.id
+    elif msg.from_user:
+        author_id = msg.from_user.id
     else:
-        cid = str(orig_chat_id)
-        link = f"https://t.me/c/{cid[4:]}/{orig_msg_id}"
-    print(f"orig_chat_id={orig_chat_id!r}, chat.username={chat.username!r}")
+        author_id = TARGET_USER
+    return {
+        "author_id": author_id,
+        "date": msg.date.timestamp(),
+        "via_bot_id": msg.via_bot.id if msg.via_bot else None,
+    }
+
+def telethon_message_meta(msg):
+    if msg is None or isinstance(msg, MessageEmpty):
+        return None
+    return {
+        "author_id": get_peer_id(msg.from_id) if msg.from_id is not None else TARGET_USER,
+        "date": msg.date.timestamp(),
+        "via_bot_id": getattr(msg, "via_bot_id", None),
+    }
+
+def remember_message(msg):
+    """Caches metadata of a Bot API message."""
+    if msg is not None:
+        MyBotState.message_meta.set((msg.chat_id, msg.message_id), bot_message_meta(msg))
+
+def remember_telethon_message(chat_id: int, msg):
+    MyBotState.message_meta.set((chat_id, msg.id), telethon_message_meta(msg))
+
+def forget_messages(chat_id: int, msg_ids):
+    for msg_id in msg_ids:
+        MyBotState.message_meta.pop((chat_id, msg_id))
+
+# chat_id -> {msg_id: future} of misses waiting for the next get_messages
+pending_message_meta = {}
+
+async def get_message_meta(chat_id: int, msg_id: int):
+    """
+    Message metadata from the cache. Misses wait a moment for others to
+    come and are fetched together in one get_messages call.
+    """
+    found, meta = MyBotState.message_meta.lookup((chat_id, msg_id))
+    if found:
+        return meta
+
+    batch = pending_message_meta.setdefault(chat_id, {})
+    fut = batch.get(msg_id)
+    if fut is None:
+        fut = asyncio.get_running_loop().create_future()
+        batch[msg_id] = fut
+        if len(batch) >= MESSAGE_META_BATCH_SIZE:
+            del pending_message_meta[chat_id]
+            asyncio.create_task(fetch_message_meta(chat_id, batch))
+        elif len(batch) == 1:
+            asyncio.create_task(flush_message_meta(chat_id, batch))
+
+    return await fut
+
+async def flush_message_meta(chat_id: int, batch: dict):
+    await asyncio.sleep(MESSAGE_META_BATCH_DELAY)
+    # a full batch is already on its way
+    if pending_message_meta.get(chat_id) is batch:
+        del pending_message_meta[chat_id]
+        await fetch_message_meta(chat_id, batch)
+
+async def fetch_message_meta(chat_id: int, batch: dict):
+    ids = list(batch)
+    try:
+        msgs = await MyBotState.mc.get_messages(chat_id, ids=ids)
+    except Exception as e:
+        print(f"exception in get_messages for {len(ids)} messages: {e}")
+        for fut in batch.values():
+            if not fut.done():
+                fut.set_exception(e)
+        return
+
+    print(f"fetched {len(ids)} messages in one call")
+    for msg_id, msg in zip(ids, msgs):
+        meta = telethon_message_meta(msg)
+        MyBotState.message_meta.set((chat_id, msg_id), meta)
+        if not batch[msg_id].done():
+            batch[msg_id].set_result(meta)
+
+async def make_link_keyboard(orig_chat_id, orig_msg_id, bot):
+    username = await get_chat_username(orig_chat_id, bot)
+    link = build_message_link(username, orig_chat_id, orig_msg_id)
     print(f"generated link: {link}")
     return InlineKeyboardMarkup([[
         InlineKeyboardButton("🕹 Перейти к сообщению", url=link)
@@ -177,6 +478,14 @@ def extract_media_signature(msg):
     if not obj:
         return None
 
+    # a small still image to compare perceptually: the smallest photo size,
+    # sticker and GIF thumbnails (the first frame)
+    image = None
+    if msg.photo:
+        image = msg.photo[0]
+    elif msg.animation or msg.sticker:
+        image = obj.thumbnail
+
     sig = {
         "file_unique_id":   getattr(obj, "file_unique_id", None),
         "mime_type":        getattr(obj, "mime_type",      None),
@@ -187,6 +496,7 @@ def extract_media_signature(msg):
         "sticker_set_name": getattr(obj, "set_name",       None),
         # we'll fill this in later if you need to compare hashes
         "sha256":         None,
+        "_image_file_id": getattr(image, "file_id", None),
     }
 
     return sig
@@ -213,6 +523,8 @@ async def check_afk_time(bot, user, chat_id):
     print(f"AFK check: delta_dead={delta_dead}, delta_alive={delta_alive}")
     print(f"AFK check: prev_dead_td={prev_dead_td}, prev_alive_td={prev_alive_td}")
 
+    streak_reset = False
+
     if delta_dead > CHAT_AFK_TIMEOUT or delta_dead > prev_dead_td:
         reanimator = parse_alias_name(user) if user else "<i>неизвестный герой</i>"
 
@@ -255,31 +567,44 @@ async def check_afk_time(bot, user, chat_id):
         else:
             streak_info = f"Количество сообщений в прошлой «жизни» — {msgs_current} (текущий рекорд — {msgs_record})."
 
-        top3_text = ""
-        if top3_streak:
-            lines = []
-            for i, (uid, cnt) in enumerate(top3_streak):
-                alias = await alias_for_uid(bot, uid)
-                lines.append(f"{i+1}). {alias} — {cnt} сообщений")
-            top3_text = "Больше всех писали:\n" + "\n".join(lines)
-
         reanim_info  = f"💉 Реанимационные мероприятия успешно провёл {reanimator}."
-        text = "\n\n".join([dead_info, alive_info, reanim_info, streak_info, top3_text])
-        await bot.send_message(chat_id, text, parse_mode="HTML")
+        announcement = [dead_info, alive_info, reanim_info, streak_info]
 
         msgs_current = 0
         user_counts_total = {}
+        streak_reset = True
         MyBotState.META_INFO["first_message_time"] = now
 
     msgs_current += 1
 
     user_counts_total[user.id] = user_counts_total.get(user.id, 0) + 1
 
+    # the state is updated before the first await: updates run concurrently,
+    # and messages that come in while the announcement is sent must see the
+    # chat alive already
     MyBotState.META_INFO["messages_in_current_streak"] = msgs_current
     MyBotState.META_INFO["user_message_counts"] = user_counts_total
 
     MyBotState.META_INFO["last_message_time"] = now
-    MyBotState.save_meta_info()
+    MyBotState.mark_dirty("meta")
+    if streak_reset:
+        MyBotState.mark_dirty("meta_user_counts")
+    else:
+        MyBotState.mark_dirty("meta_user_counts", user.id)
+
+    if not streak_reset:
+        return
+
+    top3_text = ""
+    if top3_streak:
+        lines = []
+        for i, (uid, cnt) in enumerate(top3_streak):
+            alias = await alias_for_uid(bot, uid)
+            lines.append(f"{i+1}). {alias} — {cnt} сообщений")
+        top3_text = "Больше всех писали:\n" + "\n".join(lines)
+
+    text = "\n\n".join(announcement + [top3_text])
+    await bot.send_message(chat_id, text, parse_mode="HTML")
 
 async def subscribe_flow_(
     user_id: int,
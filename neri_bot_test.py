@@ -1,15 +1,16 @@
+import asyncio
+
 from modules.commands import *
 from modules.root import *
 from modules.social_rating import *
 from modules.inline import *
 from modules.config import MyBotState
+from modules.reaction_events import ReactionUpdates
+from modules.update_processor import KeyedUpdateProcessor
 
 from datetime import time
 
 from telethon import TelegramClient, events
-from telethon.tl.types import (
-    UpdateBotMessageReaction, 
-)
 
 from telegram.ext import (
     ApplicationBuilder,
@@ -35,6 +36,10 @@ def main():
         .token(BOT_TOKEN)
         .get_updates_read_timeout(30)
         .get_updates_write_timeout(30)
+        .rate_limiter(request_limiter)
+        .concurrent_updates(KeyedUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_init(start_state_flusher)
+        .post_shutdown(flush_on_shutdown)
         .build()
     )
     app.add_handler(
@@ -65,6 +70,7 @@ def main():
     app.add_handler(CommandHandler("delete", delete_media))
     app.add_handler(CommandHandler("unban", unban_media))
     app.add_handler(CommandHandler("shutdown", shutdown_bot))
+    app.add_handler(CommandHandler("queue", queue_stats))
     app.add_handler(CommandHandler("top", top_command))
     app.add_handler(CommandHandler("ban_sc_user", ban_sc_user))
     app.add_handler(CommandHandler("unban_sc_user", unban_sc_user))
@@ -94,22 +100,32 @@ def main():
     @mc.on(events.MessageDeleted(chats=ORIG_CHANNEL_ID))
     async def on_deleted(event):
         print("delted in chat id: ", event.chat_id)
-        for msg_id in event.deleted_ids:
-            await delete_forwards(app.bot, ORIG_CHANNEL_ID, msg_id)
+        forget_messages(ORIG_CHANNEL_ID, event.deleted_ids)
+        await asyncio.gather(*(
+            delete_forwards(app.bot, ORIG_CHANNEL_ID, msg_id)
+            for msg_id in event.deleted_ids
+        ))
         
-        MyBotState.save_forward_map()
+        if event.deleted_ids:
+            MyBotState.mark_dirty("forward_map", *(
+                (ORIG_CHANNEL_ID, msg_id) for msg_id in event.deleted_ids
+            ))
     
+    @mc.on(events.NewMessage(chats=ORIG_CHANNEL_ID))
+    async def on_new_message(event):
+        # commands and service messages don't reach handle_cocksize
+        remember_telethon_message(ORIG_CHANNEL_ID, event.message)
+
     @mc.on(events.MessageEdited(chats=ORIG_CHANNEL_ID))
     async def on_edited(event):
         print("edited in chat id: ", event.chat_id)
         orig_id   = event.chat_id
         orig_msg  = event.message.id
+        remember_telethon_message(orig_id, event.message)
         await edit_forwards(app.bot, event, orig_id, orig_msg)
 
-    @mc.on(events.Raw)
+    @mc.on(ReactionUpdates)
     async def handler(event):
-        if not isinstance(event, UpdateBotMessageReaction):
-            return
         await on_message_reaction(mc, event)
 
     app.job_queue.run_repeating(
@@ -118,6 +134,18 @@ def main():
         first=300 
     )
     
+    app.job_queue.run_repeating(
+        compact_social_rating,
+        interval=RATING_COMPACT_INTERVAL,
+        first=RATING_COMPACT_INTERVAL
+    )
+
+    app.job_queue.run_repeating(
+        evict_old_forwards,
+        interval=FORWARD_EVICT_INTERVAL,
+        first=FORWARD_EVICT_INTERVAL
+    )
+
     app.job_queue.run_repeating(
         refresh_polls,
         interval=300,
@@ -142,6 +170,8 @@ def main():
 
     app.job_queue.run_once(random_deposit, when=1)
 
+    app.job_queue.run_once(seed_chat_members, when=1)
+
     app.run_polling(
         allowed_updates=Update.ALL_TYPES,
         timeout=30,
@@ -0,0 +1,72 @@
+"""
+Needs the bot's environment (.env, Google credentials, info.db), the
+same as running the bot. Skipped when that is not available.
+"""
+import asyncio
+import sys
+import unittest
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+try:
+    from modules import utils
+    from modules.config import MyBotState
+except Exception as e:
+    raise unittest.SkipTest(f"bot environment not available: {e}")
+
+
+def user(uid):
+    return SimpleNamespace(id=uid, first_name=f"user{uid}", last_name=None, username=None)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        # a rate-limited send, other updates run meanwhile
+        await asyncio.sleep(0.05)
+        self.sent.append((chat_id, text))
+
+
+async def slow_alias(bot, uid):
+    await asyncio.sleep(0.01)
+    return f"alias{uid}"
+
+
+class CheckAfkTimeTest(unittest.IsolatedAsyncioTestCase):
+    async def test_overlapping_messages_announce_once(self):
+        now = datetime.now()
+        meta = {
+            "last_message_time": now - timedelta(hours=2),
+            "first_message_time": now - timedelta(hours=3),
+            "messages_in_current_streak": 5,
+            "top_streak_messages": 10,
+            "user_message_counts": {1: 5},
+            # records no quiet spell can beat, only CHAT_AFK_TIMEOUT counts
+            "afk_time": int(timedelta(days=30).total_seconds()),
+            "alive_time": int(timedelta(days=30).total_seconds()),
+        }
+        bot = FakeBot()
+
+        with mock.patch.dict(MyBotState.META_INFO, meta), \
+                mock.patch.object(utils, "alias_for_uid", slow_alias):
+            await asyncio.gather(
+                utils.check_afk_time(bot, user(1), -100),
+                utils.check_afk_time(bot, user(2), -100),
+                utils.check_afk_time(bot, user(3), -100),
+            )
+
+            self.assertEqual(len(bot.sent), 1)
+            self.assertIn("alias1", bot.sent[0][1])
+            self.assertEqual(MyBotState.META_INFO["messages_in_current_streak"], 3)
+            self.assertEqual(MyBotState.META_INFO["user_message_counts"], {1: 1, 2: 1, 3: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()